@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+""" Events per second published by hirnoty-send and by hirnoty.client
+
+Usage: python -m benchmarks.client_bench [--spawns 50] [--events 100000]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import zmq
+
+from benchmarks.replay import free_port
+from hirnoty.client import AsyncClient, Client
+
+SEND_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "hirnoty-send")
+
+
+class Sink(object):
+    """ Counts the lines received in a PULL socket """
+    def __init__(self, addr):
+        self.socket = zmq.Context.instance().socket(zmq.PULL)
+        self.socket.bind(f"tcp://{addr}")
+        self.lines = 0
+        self.messages = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                _, data = self.socket.recv_multipart()
+            except zmq.ZMQError:
+                return
+            self.messages += 1
+            self.lines += data.count(b"\n") + 1
+
+    def wait_for(self, lines, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self.lines < lines and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.lines >= lines
+
+
+def bench_spawn(sink, addr, count):
+    start = time.perf_counter()
+    for i in range(count):
+        subprocess.run([sys.executable, SEND_SCRIPT, "-a", addr, "-t",
+                        "bench", "-m", f"event {i}"], check=True)
+    sink.wait_for(count)
+    return count / (time.perf_counter() - start)
+
+
+def bench_client(sink, addr, count, linger):
+    target = sink.lines + count
+    start = time.perf_counter()
+    with Client(addr, linger, max_batch=1000) as client:
+        for i in range(count):
+            client.send("bench", f"event {i}")
+    sink.wait_for(target)
+    return count / (time.perf_counter() - start)
+
+
+def bench_async_client(sink, addr, count, linger):
+    target = sink.lines + count
+
+    async def run():
+        async with AsyncClient(addr, linger, max_batch=1000) as client:
+            for i in range(count):
+                await client.send("bench", f"event {i}")
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    sink.wait_for(target)
+    return count / (time.perf_counter() - start)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spawns', type=int, default=50,
+                        help="events published spawning hirnoty-send")
+    parser.add_argument('--events', type=int, default=100000,
+                        help="events published with the client library")
+    parser.add_argument('--linger', type=float, default=0.05,
+                        help="linger used in the batching cases")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    addr = f"127.0.0.1:{free_port()}"
+    sink = Sink(addr)
+    cases = [("hirnoty-send per event",
+              lambda: bench_spawn(sink, addr, args.spawns)),
+             ("Client", lambda: bench_client(sink, addr, args.events, 0)),
+             (f"Client linger={args.linger}",
+              lambda: bench_client(sink, addr, args.events, args.linger)),
+             ("AsyncClient",
+              lambda: bench_async_client(sink, addr, args.events, 0)),
+             (f"AsyncClient linger={args.linger}",
+              lambda: bench_async_client(sink, addr, args.events,
+                                         args.linger))]
+    for name, func in cases:
+        print(f"{name:32} {func():12.0f} events/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+""" Deterministic synthetic corpus for the index and storage benchmarks
+
+The same seed always produces the same entries, so results obtained in
+different runs (or machines) can be compared.
+"""
+import itertools
+import random
+from collections import namedtuple
+
+CorpusEntry = namedtuple("CorpusEntry", ["filename", "keywords", "content",
+                                         "extra"])
+
+SYLLABLES = ["ka", "to", "ri", "mu", "sel", "an", "dor", "vi", "lo", "ne",
+             "qua", "ber", "zo", "fi", "tra", "gen", "pol", "us", "mar", "el"]
+EXTENSIONS = ["pdf", "zip", "mp4", "jpg", "txt", "epub", "tar.gz", "docx"]
+# fraction of entries of each content kind, the rest has no content
+CONTENT_KINDS = [("text", 0.5), ("random", 0.3), ("zeros", 0.2)]
+
+
+def make_vocabulary(size, seed=0):
+    """ Build a list of unique pseudo words """
+    rng = random.Random(seed)
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES)
+                       for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class ZipfSampler(object):
+    """ Sample items so that the k-th most frequent has weight 1/k^s """
+    def __init__(self, items, rng, s=1.1):
+        self.items = items
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(
+            1.0 / (rank ** s) for rank in range(1, len(items) + 1)))
+
+    def sample(self, k=1):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+
+class Corpus(object):
+    """ Generator of synthetic index entries
+
+    Args:
+        seed: seed of the random generator
+        vocabulary_size: number of distinct words
+        content_fraction: fraction of entries carrying a file content
+        content_size: (min, max) size in bytes of the file contents
+    """
+    def __init__(self, seed=0, vocabulary_size=20000, content_fraction=0.1,
+                 content_size=(256, 8192)):
+        self.seed = seed
+        self.vocabulary = make_vocabulary(vocabulary_size, seed)
+        self.content_fraction = content_fraction
+        self.content_size = content_size
+
+    def _content(self, rng, sampler, index):
+        if rng.random() >= self.content_fraction:
+            return b""
+        size = rng.randint(*self.content_size)
+        kind = rng.choices([kind for kind, _ in CONTENT_KINDS],
+                           [weight for _, weight in CONTENT_KINDS])[0]
+        # the index makes contents unique, as entry ids are content hashes
+        prefix = f"{index}\n".encode()
+        if kind == "text":
+            words = " ".join(sampler.sample(size // 6 + 1)).encode()
+            return prefix + words[:size]
+        elif kind == "random":
+            return prefix + rng.randbytes(size)
+        return prefix + bytes(size)
+
+    def entries(self, count):
+        """ Yield count entries """
+        rng = random.Random(self.seed)
+        sampler = ZipfSampler(self.vocabulary, rng)
+        for index in range(count):
+            name_words = sampler.sample(rng.randint(1, 3))
+            year = rng.randint(1990, 2030)
+            filename = "{}-{}.{}".format("_".join(name_words), year,
+                                         rng.choice(EXTENSIONS))
+            keywords = " ".join(sampler.sample(rng.randint(2, 6)))
+            extra = f"BQAC{rng.getrandbits(96):024x}" \
+                if rng.random() < 0.3 else ""
+            yield CorpusEntry(filename, keywords,
+                              self._content(rng, sampler, index), extra)
+
+    def queries(self, count, seed=None):
+        """ Yield count queries of one or two words
+
+        The words follow the same distribution as the entries, so popular
+        words are queried more often, as it happens with real users.
+        """
+        rng = random.Random(self.seed + 1 if seed is None else seed)
+        sampler = ZipfSampler(self.vocabulary, rng)
+        for _ in range(count):
+            yield " ".join(sampler.sample(1 if rng.random() < 0.7 else 2))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+""" Benchmarks for the index engines and the file storage
+
+Every case runs in a fresh process, so the reported RSS belongs to it only.
+
+Usage examples:
+    python -m benchmarks.index_bench --sizes 10000 100000 -o results.json
+    python -m benchmarks.index_bench --baseline baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import tempfile
+import time
+import zlib
+
+from benchmarks.corpus import Corpus
+from hirnoty.file_manager import CompressingFileManager
+from hirnoty.index import SimpleIndex, dump_index_entry, load_index_entry, \
+    IndexEntry
+
+ENGINES = {"linear": False, "inverted": True}
+# metrics where a bigger value is better, any other one is better if smaller
+HIGHER_IS_BETTER = set(["add_per_sec", "parse_per_sec", "write_mb_per_sec",
+                        "read_mb_per_sec"])
+IGNORED_METRICS = set(["entries", "queries", "bytes"])
+
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/status", "r") as fhandle:
+            for line in fhandle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # maximum RSS is the best we can get without procfs
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        index = min(len(ordered) - 1, int(len(ordered) * point / 100))
+        result[f"query_p{point}_ms"] = ordered[index] * 1000
+    result["query_max_ms"] = ordered[-1] * 1000
+    return result
+
+
+def bench_index(engine, size, queries, seed, content_fraction):
+    corpus = Corpus(seed, content_fraction=content_fraction)
+    use_inverted_index = ENGINES[engine]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index = SimpleIndex(tmpdir, None, use_inverted_index, 0)
+        start = time.perf_counter()
+        for entry in corpus.entries(size):
+            try:
+                index.add_entry(*entry)
+            except FileExistsError:
+                pass
+        add_elapsed = time.perf_counter() - start
+        index.close()
+
+        rss_before = current_rss_kb()
+        start = time.perf_counter()
+        # without the search cache, repeated queries would measure it
+        # instead of the engine
+        index = SimpleIndex(tmpdir, None, use_inverted_index, 0)
+        load_elapsed = time.perf_counter() - start
+        rss_after = current_rss_kb()
+
+        latencies = []
+        for query in corpus.queries(queries):
+            start = time.perf_counter()
+            index.search(query)
+            latencies.append(time.perf_counter() - start)
+        index.close()
+
+    result = {"entries": size,
+              "queries": queries,
+              "add_per_sec": size / add_elapsed,
+              "load_s": load_elapsed,
+              "rss_kb": rss_after,
+              "index_rss_kb": max(rss_after - rss_before, 0)}
+    result.update(percentiles(latencies))
+    return result
+
+
+def bench_parse(size, seed):
+    corpus = Corpus(seed, content_fraction=0)
+    lines = [dump_index_entry(IndexEntry("A", "0" * 64, entry.filename,
+                                         entry.keywords, entry.extra))[:-1]
+             for entry in corpus.entries(size)]
+    start = time.perf_counter()
+    for line in lines:
+        load_index_entry(line)
+    elapsed = time.perf_counter() - start
+    return {"entries": size, "parse_per_sec": size / elapsed}
+
+
+def bench_file_manager(size, seed):
+    corpus = Corpus(seed, content_fraction=1)
+    contents = [entry.content for entry in corpus.entries(size)]
+    total = sum(len(content) for content in contents)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fm = CompressingFileManager(tmpdir)
+        start = time.perf_counter()
+        for i, content in enumerate(contents):
+            fm.write_content(f"{i:064x}", content)
+        write_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(len(contents)):
+            fm.read_content(f"{i:064x}")
+        read_elapsed = time.perf_counter() - start
+    compressed = sum(len(zlib.compress(content)) for content in contents)
+    return {"entries": size,
+            "bytes": total,
+            "compression_ratio": compressed / total,
+            "write_mb_per_sec": total / write_elapsed / 1e6,
+            "read_mb_per_sec": total / read_elapsed / 1e6}
+
+
+def _run_case(args):
+    name, func, func_args = args
+    return name, func(*func_args)
+
+
+def run_cases(cases):
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for case in cases:
+        # one process per case, so memory measurements don't interfere
+        with context.Pool(1) as pool:
+            name, result = pool.apply(_run_case, (case,))
+        print(f"{name}: " + ", ".join(f"{key}={value:.4g}"
+                                      for key, value in result.items()),
+              file=sys.stderr)
+        results[name] = result
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Return the list of regressions compared to a baseline
+
+    A metric regresses when it is worse than the baseline by more than
+    the threshold (relative).
+    """
+    regressions = []
+    for name, metrics in results.items():
+        base_metrics = baseline.get(name)
+        if not base_metrics:
+            continue
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if metric in IGNORED_METRICS or not base:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                change = (base - value) / base
+            else:
+                change = (value - base) / base
+            if change > threshold:
+                regressions.append((name, metric, base, value, change))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000],
+                        help="number of entries of each index case")
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES),
+                        choices=list(ENGINES))
+    parser.add_argument('--queries', type=int, default=1000,
+                        help="number of queries of each index case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--content-fraction', type=float, default=0.1,
+                        help="fraction of index entries with file content")
+    parser.add_argument('--files', type=int, default=2000,
+                        help="number of files of the file manager case")
+    parser.add_argument('-o', dest='output', default=None,
+                        help="write the results in JSON to this file")
+    parser.add_argument('--baseline', default=None,
+                        help="JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative change considered a regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cases = []
+    for size in args.sizes:
+        for engine in args.engines:
+            cases.append((f"index.{engine}.{size}", bench_index,
+                          (engine, size, args.queries, args.seed,
+                           args.content_fraction)))
+        cases.append((f"parse.{size}", bench_parse, (size, args.seed)))
+    cases.append((f"file_manager.{args.files}", bench_file_manager,
+                  (args.files, args.seed)))
+    results = run_cases(cases)
+    report = {"meta": {"python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "seed": args.seed,
+                       "time": time.time()},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as fhandle:
+            json.dump(report, fhandle, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r") as fhandle:
+            baseline = json.load(fhandle)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, base, value, change in regressions:
+            print(f"REGRESSION {name} {metric}: {base:.4g} -> {value:.4g} "
+                  f"(worse by {change:.1%})")
+        if regressions:
+            sys.exit(1)
+        print("No regressions found")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+""" Peak memory and wall clock indexing a burst of uploads
+
+Compares the previous way, every upload downloaded and indexed on its own
+at the same time, with the ingest pipeline.
+
+Usage: python -m benchmarks.ingest_bench [--files 50] [--size 1048576]
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+from hirnoty.index import SimpleIndex
+from hirnoty.ingest import IngestPipeline, Upload
+
+
+class FakeBot(object):
+    """ Downloads take latency seconds and return size random bytes """
+    def __init__(self, size, latency):
+        self.size = size
+        self.latency = latency
+
+    async def download_file_by_id(self, file_id, destination):
+        # different content per file, compressible as real files are
+        rng = random.Random(file_id)
+        words = [rng.randbytes(8) for _ in range(256)]
+        chunk = b" ".join(rng.choice(words) for _ in range(8192))
+        chunks = max(1, self.size // len(chunk))
+        # the content arrives during the whole download
+        for _ in range(chunks):
+            await asyncio.sleep(self.latency / chunks)
+            destination.write(chunk)
+
+
+async def unbounded(bot, index, files):
+    async def one(i):
+        file_io = BytesIO()
+        await bot.download_file_by_id(f"file-{i}", file_io)
+        index.add_entry(f"file{i}.bin", "burst", file_io.getvalue(),
+                        f"file-{i}")
+
+    await asyncio.gather(*[one(i) for i in range(files)])
+
+
+async def pipeline(bot, index, files):
+    done = asyncio.Event()
+    remaining = [files]
+
+    async def reply(text):
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    ingest = IngestPipeline(bot, index)
+    for i in range(files):
+        await ingest.submit(Upload(f"file-{i}", f"file{i}.bin", "burst",
+                                   reply))
+    await done.wait()
+    await ingest.close()
+
+
+def measure(func, files, size, latency):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index = SimpleIndex(tmpdir)
+        bot = FakeBot(size, latency)
+        tracemalloc.start()
+        start = time.perf_counter()
+        asyncio.run(func(bot, index, files))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert len(index.search("burst")) == files
+        index.close()
+    return elapsed, peak
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--size', type=int, default=1024 ** 2,
+                        help="bytes per file")
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help="seconds per download")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for name, func in (("unbounded", unbounded), ("pipeline", pipeline)):
+        elapsed, peak = measure(func, args.files, args.size, args.latency)
+        print(f"{name:12} {elapsed:8.2f} s {peak / 1024 ** 2:10.1f} MiB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+""" Measure the overhead added by the metrics instrumentation
+
+Usage: python -m benchmarks.metrics_bench [iterations]
+"""
+import sys
+import timeit
+
+from hirnoty.metrics import Registry
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    registry = Registry()
+    counter = registry.counter("bench_total")
+    gauge = registry.gauge("bench_gauge")
+    histogram = registry.histogram("bench_seconds")
+
+    def timed():
+        with histogram.time():
+            pass
+
+    cases = [("counter.inc", counter.inc),
+             ("gauge.set", lambda: gauge.set(1)),
+             ("histogram.observe", lambda: histogram.observe(0.003)),
+             ("histogram.time", timed),
+             ("baseline (empty call)", lambda: None)]
+    for name, func in cases:
+        elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+        print(f"{name:24} {elapsed / iterations * 1e6:8.3f} us/event")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+""" Replay recorded traffic against a local hirnoty instance
+
+Traffic is recorded by setting RECORD_PATH in the configuration. The
+replay talks to a stub of the bot API (benchmarks/stub_api.py), so telegram
+is never contacted, and reports the latency from each update to its first
+reply and the delivery of queue notifications.
+
+Replies are attributed to the update they answer when they quote it,
+otherwise to the oldest unanswered update of the same chat.
+
+Usage: python -m benchmarks.replay recording.jsonl [--speed 10]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import sys
+import tempfile
+import time
+from collections import deque
+
+import zmq
+import zmq.asyncio
+from aiogram import Bot
+
+from benchmarks.stub_api import StubBotAPI, TOKEN
+from hirnoty.recorder import MQ, UPDATE, load_records
+
+log = logging.getLogger(__name__)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def update_kind(update):
+    message = update.get("message") or {}
+    if "document" in message:
+        return "doc"
+    if "video" in message:
+        return "video"
+    text = message.get("text", "")
+    if text.startswith("/"):
+        return text.split()[0][1:].split("@")[0]
+    return "other"
+
+
+def summarize(latencies):
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    return {f"p{point}_ms": ordered[min(len(ordered) - 1,
+                                        int(len(ordered) * point / 100))]
+            * 1000 for point in (50, 90, 99)}
+
+
+class Tracker(object):
+    """ Matches outgoing messages with the traffic that caused them """
+    def __init__(self):
+        self.pending = {}  # chat id -> deque of [message_id, kind, time]
+        self.by_message_id = {}
+        self.updates = {}  # kind -> {"sent", "answered", "replies", ...}
+        self.notifications = {}  # topic -> {"sent", "delivered", ...}
+        self._notification_times = {}  # text -> deque of send times
+
+    def update_sent(self, update):
+        message = update.get("message") or {}
+        kind = update_kind(update)
+        stats = self.updates.setdefault(kind, {"sent": 0, "answered": 0,
+                                               "replies": 0,
+                                               "latencies": []})
+        stats["sent"] += 1
+        if message:
+            item = [message.get("message_id"), kind, time.perf_counter(),
+                    False]
+            self.pending.setdefault(message["chat"]["id"], deque()) \
+                .append(item)
+            self.by_message_id[(message["chat"]["id"],
+                                message.get("message_id"))] = item
+
+    def notification_sent(self, topic, data):
+        stats = self.notifications.setdefault(topic, {"sent": 0,
+                                                      "delivered": 0,
+                                                      "latencies": []})
+        stats["sent"] += 1
+        self._notification_times.setdefault(f"{topic}: {data}", deque()) \
+            .append(time.perf_counter())
+
+    def on_message(self, method, chat_id, message):
+        now = time.perf_counter()
+        text = message.get("text", "")
+        if text in self._notification_times:
+            topic = text.split(": ", 1)[0]
+            stats = self.notifications[topic]
+            stats["delivered"] += 1
+            times = self._notification_times[text]
+            # with several subscribers the same notification is delivered
+            # more than once, the extra copies reuse the last send time
+            sent = times.popleft() if len(times) > 1 else times[0]
+            stats["latencies"].append(now - sent)
+            return
+        item = None
+        reply_to = message.get("reply_to_message_id")
+        if reply_to is not None:
+            item = self.by_message_id.get((chat_id, int(reply_to)))
+        if item is None:
+            pending = self.pending.get(chat_id, ())
+            item = next((candidate for candidate in pending
+                         if not candidate[3]), None)
+            if item is None and pending:
+                item = pending[-1]
+        if item is None:
+            return
+        stats = self.updates[item[1]]
+        stats["replies"] += 1
+        if not item[3]:
+            item[3] = True
+            stats["answered"] += 1
+            stats["latencies"].append(now - item[2])
+
+    def report(self):
+        result = {"updates": {}, "notifications": {}}
+        for kind, stats in self.updates.items():
+            result["updates"][kind] = {
+                "sent": stats["sent"], "answered": stats["answered"],
+                "replies": stats["replies"],
+                **summarize(stats["latencies"])}
+        for topic, stats in self.notifications.items():
+            result["notifications"][topic] = {
+                "sent": stats["sent"], "delivered": stats["delivered"],
+                "delivered_per_sent": stats["delivered"] / stats["sent"],
+                **summarize(stats["latencies"])}
+        return result
+
+
+async def replay(args):
+    from hirnoty.bot import BotManager
+    from hirnoty.bot_commands import Commands
+    from hirnoty.mq import MessageQueue
+    from hirnoty.settings import config
+
+    records = list(load_records(args.recording))
+    if not records:
+        print("Nothing to replay", file=sys.stderr)
+        return {}
+    stub = StubBotAPI(args.latency, args.rate_limit_ratio)
+    tracker = Tracker()
+    stub.listeners.append(tracker.on_message)
+    url = await stub.start()
+
+    index_dir = tempfile.TemporaryDirectory()
+    # the replay is run by whoever recorded it, so skip the security
+    # checks, otherwise the OTPs consumed in production would be needed
+    config["ACL"] = None
+    config["OTP"] = None
+    local_config = dict(config)
+    local_config["INDEX_DIR"] = index_dir.name
+    # never touch the production shards nor upload to the storage chat
+    local_config["INDEX_SHARDS"] = None
+    local_config["STORAGE_CHAT"] = None
+    if args.script_dir:
+        local_config["SCRIPT_DIR"] = args.script_dir
+    mq_address = f"127.0.0.1:{free_port()}"
+    bot_manager = BotManager(TOKEN, url)
+    mq = MessageQueue(mq_address)
+    commands = Commands(local_config, bot_manager, mq)
+    context = zmq.asyncio.Context()
+    push = context.socket(zmq.PUSH)
+    push.connect(f"tcp://{mq_address}")
+
+    # queue callbacks use the bot of the context, as they do in production
+    Bot.set_current(bot_manager.bot)
+    tasks = [asyncio.create_task(mq.receive_loop()),
+             asyncio.create_task(bot_manager.dispatcher.start_polling(
+                 timeout=1, relax=0))]
+    start = time.perf_counter()
+    first = records[0]["t"]
+    for record in records:
+        delay = (record["t"] - first) / args.speed - \
+            (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if record["kind"] == UPDATE:
+            tracker.update_sent(record["data"])
+            stub.push_update(record["data"])
+        elif record["kind"] == MQ:
+            data = record["data"]
+            tracker.notification_sent(data["topic"], data["data"])
+            await push.send_multipart([data["topic"].encode(),
+                                       data["data"].encode()])
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - start
+
+    bot_manager.dispatcher.stop_polling()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await commands.shutdown()
+    commands.close()
+    await (await bot_manager.bot.get_session()).close()
+    push.close()
+    mq.socket.close()
+    await stub.stop()
+    index_dir.cleanup()
+
+    report = tracker.report()
+    report["elapsed_s"] = elapsed
+    report["api"] = stub.stats
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('recording', help="JSON lines file to replay")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed factor, 2 is twice as fast")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to each bot API call")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help="fraction of bot API calls answered with 429")
+    parser.add_argument('--drain', type=float, default=2.0,
+                        help="seconds to wait for replies after the replay")
+    parser.add_argument('--script-dir', default=None,
+                        help="scripts used by /exec, defaults to SCRIPT_DIR")
+    parser.add_argument('-o', dest='output', default=None,
+                        help="write the report in JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(replay(args))
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fhandle:
+            fhandle.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
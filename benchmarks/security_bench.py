@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+""" Overhead of the security checks per message
+
+Usage: python -m benchmarks.security_bench [messages]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from hirnoty.security import run_handler_if_allowed, temporal_ban
+from hirnoty.settings import config
+
+
+async def handler(message):
+    pass
+
+
+async def measure(func, messages):
+    start = time.perf_counter()
+    for message in messages:
+        await func(message)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        otp_path = os.path.join(tmpdir, "otp.txt")
+        with open(otp_path, "w") as fhandle:
+            fhandle.write("\n".join(f"pass{i:08d}" for i in range(count)))
+        config["ACL"] = [1, 2, 3]
+        for user_id in range(100, 1100):
+            temporal_ban(user_id)
+        messages = [{"from": {"id": 1}, "text": f"/ping pass{i:08d}"}
+                    for i in reversed(range(count))]
+        config["OTP"] = None
+        baseline = asyncio.run(measure(handler, messages))
+        acl_only = asyncio.run(measure(run_handler_if_allowed(handler),
+                                       messages))
+        config["OTP"] = otp_path
+        with_otp = asyncio.run(measure(run_handler_if_allowed(handler),
+                                       messages))
+    print(f"{'handler alone':24} {baseline:8.3f} us/message")
+    print(f"{'ACL + bans':24} {acl_only:8.3f} us/message")
+    print(f"{'ACL + bans + OTP':24} {with_otp:8.3f} us/message")
+
+
+if __name__ == "__main__":
+    main()
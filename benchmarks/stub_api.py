@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+""" Local stub of the telegram bot API
+
+Only the methods used by hirnoty are implemented (getUpdates, sendMessage,
+sendDocument, sendMediaGroup and getFile). Every outgoing message is
+reported to the listeners, so load tools can measure when replies arrive.
+
+Usage: python -m benchmarks.stub_api [--port PORT] [--latency SECONDS]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+TOKEN = "123456:stub-token-for-local-testing"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "hirnoty",
+            "username": "hirnoty_stub_bot"}
+
+
+class StubBotAPI(object):
+    """ Fake bot API server
+
+    Args:
+        latency: seconds added to every method but getUpdates
+        rate_limit_ratio: fraction of requests answered with a 429 error
+        retry_after: retry_after parameter of the 429 errors
+        seed: seed used to decide which requests are rate limited
+    """
+    def __init__(self, latency=0.0, rate_limit_ratio=0.0, retry_after=1,
+                 seed=0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._updates = []
+        self._next_update_id = 1
+        self._new_updates = asyncio.Event()
+        self._next_message_id = 1
+        self._files = {}
+        self.listeners = []
+        self.stats = {"requests": 0, "rate_limited": 0}
+        self._runner = None
+        self.url = None
+
+    def push_update(self, update):
+        """ Queue an update, the update_id is overwritten
+
+        Returns:
+            the update id assigned
+        """
+        update = dict(update)
+        update["update_id"] = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._new_updates.set()
+        return update["update_id"]
+
+    def add_file(self, file_id, content):
+        self._files[file_id] = content
+
+    def _file_content(self, file_id):
+        content = self._files.get(file_id)
+        if content is None:
+            # deterministic content, so repeated downloads are identical
+            content = hashlib.sha256(file_id.encode()).digest() * 32
+        return content
+
+    def _message(self, chat_id, **kwargs):
+        message = {"message_id": self._next_message_id,
+                   "date": int(time.time()),
+                   "from": BOT_USER,
+                   "chat": {"id": int(chat_id), "type": "private"}}
+        message.update(kwargs)
+        self._next_message_id += 1
+        return message
+
+    def _document(self, value, file_name="document"):
+        if isinstance(value, web.FileField):
+            content = value.file.read()
+            file_id = "stub-" + hashlib.sha256(content).hexdigest()[:32]
+            self.add_file(file_id, content)
+            file_name = value.filename or file_name
+        else:
+            file_id = value
+        return {"file_id": file_id, "file_unique_id": file_id[-16:],
+                "file_name": file_name,
+                "file_size": len(self._file_content(file_id))}
+
+    def _notify(self, method, chat_id, message):
+        for listener in self.listeners:
+            listener(method, int(chat_id), message)
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self._updates = [update for update in self._updates
+                         if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    async def _send_message(self, params):
+        message = self._message(params["chat_id"], text=params["text"])
+        self._notify("sendMessage", params["chat_id"], message)
+        return message
+
+    async def _send_document(self, params):
+        message = self._message(params["chat_id"],
+                                document=self._document(params["document"]))
+        self._notify("sendDocument", params["chat_id"], message)
+        return message
+
+    async def _send_media_group(self, params):
+        messages = []
+        for media in json.loads(params["media"]):
+            value = media["media"]
+            if value.startswith("attach://"):
+                value = params[value[len("attach://"):]]
+            message = self._message(params["chat_id"],
+                                    document=self._document(value))
+            self._notify("sendMediaGroup", params["chat_id"], message)
+            messages.append(message)
+        return messages
+
+    async def _get_file(self, params):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id[-16:],
+                "file_size": len(self._file_content(file_id)),
+                "file_path": f"documents/{file_id}"}
+
+    async def _get_me(self, params):
+        return BOT_USER
+
+    async def _delete_webhook(self, params):
+        return True
+
+    def _methods(self):
+        return {"getupdates": self._get_updates,
+                "sendmessage": self._send_message,
+                "senddocument": self._send_document,
+                "sendmediagroup": self._send_media_group,
+                "getfile": self._get_file,
+                "getme": self._get_me,
+                "deletewebhook": self._delete_webhook}
+
+    async def handle_method(self, request):
+        method = request.match_info["method"].lower()
+        handler = self._methods().get(method)
+        if handler is None:
+            return web.json_response({"ok": False, "error_code": 404,
+                                      "description": "Not Found: method "
+                                                     "not found"},
+                                     status=404)
+        params = dict(await request.post())
+        params.update(request.query)
+        self.stats["requests"] += 1
+        if method != "getupdates":
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self._rng.random() < self.rate_limit_ratio:
+                self.stats["rate_limited"] += 1
+                return web.json_response(
+                    {"ok": False, "error_code": 429,
+                     "description": "Too Many Requests: retry after "
+                                    f"{self.retry_after}",
+                     "parameters": {"retry_after": self.retry_after}},
+                    status=429)
+        return web.json_response({"ok": True,
+                                  "result": await handler(params)})
+
+    async def handle_file(self, request):
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        return web.Response(body=self._file_content(file_id))
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 ** 2)
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        log.info("Stub bot API listening in %s", self.url)
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to each API call")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help="fraction of calls answered with 429")
+    return parser.parse_args()
+
+
+async def serve(args):
+    stub = StubBotAPI(args.latency, args.rate_limit_ratio)
+    stub.listeners.append(
+        lambda method, chat_id, message: print(json.dumps(
+            {"method": method, "chat_id": chat_id, "message": message})))
+    url = await stub.start(port=args.port)
+    print(f"Serving in {url}, use API_SERVER = '{url}'")
+    await asyncio.Event().wait()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
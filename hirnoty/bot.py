@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 import logging
 import shlex
+import time
 
 from aiogram import Bot, Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types.message import ContentType
 from aiogram.utils.executor import start_polling
 
+from hirnoty.metrics import registry
+from hirnoty.recorder import UPDATE
 from hirnoty.security import run_handler_if_allowed
 from hirnoty.settings import config
 
@@ -17,16 +22,62 @@ VIDEO = ContentType.VIDEO
 
 
 def log_message(func):
+    latency = registry.histogram("hirnoty_handler_seconds",
+                                 "Time spent running a handler",
+                                 handler=func.__name__)
+    errors = registry.counter("hirnoty_handler_errors_total",
+                              "Handler invocations that raised",
+                              handler=func.__name__)
+
     async def new_func(message):
         log.info('Got message: %s', message)
-        await func(message)
+        try:
+            with latency.time():
+                await func(message)
+        except Exception:
+            errors.inc()
+            raise
     return new_func
 
 
+class RecordingMiddleware(BaseMiddleware):
+    def __init__(self, recorder):
+        super().__init__()
+        self._recorder = recorder
+
+    async def on_pre_process_update(self, update, data):
+        self._recorder.record(UPDATE, update.to_python())
+
+
+class ActivityMiddleware(BaseMiddleware):
+    def __init__(self, bot_manager):
+        super().__init__()
+        self._bot_manager = bot_manager
+
+    async def on_pre_process_update(self, update, data):
+        self._bot_manager.last_activity = time.monotonic()
+
+
 class BotManager(object):
-    def __init__(self, token):
-        self.bot = Bot(token=token)
+    def __init__(self, token, server=None, recorder=None):
+        """ Initialise bot
+
+        Args:
+            token: telegram bot token
+            server: base URL of the bot API server, None for telegram's
+            recorder: Recorder where incoming updates are saved
+        """
+        if server:
+            self.bot = Bot(token=token,
+                           server=TelegramAPIServer.from_base(server))
+        else:
+            self.bot = Bot(token=token)
         self.dispatcher = Dispatcher(self.bot)
+        # time of the last update, background work waits until idle
+        self.last_activity = time.monotonic()
+        self.dispatcher.middleware.setup(ActivityMiddleware(self))
+        if recorder:
+            self.dispatcher.middleware.setup(RecordingMiddleware(recorder))
 
     def register_handler(self, handler, commands=None, regexp=None,
                          content_types=None):
@@ -35,5 +86,6 @@ class BotManager(object):
             commands=commands, regexp=regexp,
             content_types=content_types)
 
-    def run(self, on_startup=None):
-        start_polling(self.dispatcher, on_startup=on_startup)
+    def run(self, on_startup=None, on_shutdown=None):
+        start_polling(self.dispatcher, on_startup=on_startup,
+                      on_shutdown=on_shutdown)
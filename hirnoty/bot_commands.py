@@ -1,34 +1,85 @@
 #!/usr/bin/env python3
+import asyncio
+import functools
 import hashlib
 import inspect
 import json
 import logging
 import re
 import shlex
+import time
 from io import BytesIO
 from os import path
 
+from aiogram.types import InputMediaDocument
+from aiogram.utils.exceptions import RetryAfter
+
 from hirnoty.bot import DOCUMENT, ANY, VIDEO
 from hirnoty.file_manager import CompressingFileManager
 from hirnoty.index import CompressingFileManager, SimpleIndex, FILE_PRESENT
+from hirnoty.ingest import IngestPipeline, Upload
+from hirnoty.joblog import GrepTimeout, JobLogStore
 from hirnoty.jobs import Runner, ScriptNotFound
+from hirnoty.maintenance import IndexMaintainer
+from hirnoty.metrics import registry
+from hirnoty.prewarm import Prewarmer
+from hirnoty.profiler import MAX_SECONDS, ProfileInProgress, profile
+from hirnoty.scheduler import Schedule, Scheduler
+from hirnoty.sharded_index import ShardedIndex
 
 log = logging.getLogger(__name__)
 
 
 class Commands(object):
     CACHE_FILE = ".hirnoty.cache"
+    SCHEDULES_FILE = ".hirnoty.schedules"
+    JOB_LOG_DIR = "jobs"
+    # telegram rejects longer messages
+    MAX_MESSAGE_LENGTH = 4096
+    MAX_TAIL_LINES = 200
+    # time budget of /grep, its pattern comes from the user
+    GREP_SECONDS = 10
+    # telegram accepts up to 10 documents per media group
+    MEDIA_GROUP_SIZE = 10
+    # concurrent requests while sending search results
+    SEND_CONCURRENCY = 3
+    SEND_RETRIES = 3
 
     def __init__(self, config, bot_manager, mq):
         self._bot = bot_manager
         self._mq = mq
         self._config = config
         self._fm = CompressingFileManager(self._config["INDEX_DIR"])
-        self._index = SimpleIndex(self._config["INDEX_DIR"], self._fm,
-                                  self._config["INVERTED_INDEX"])
+        if self._config["INDEX_SHARDS"]:
+            self._index = ShardedIndex(self._config["INDEX_SHARDS"],
+                                       self._config["INVERTED_INDEX"],
+                                       self._config["SEARCH_CACHE_SIZE"])
+        else:
+            self._index = SimpleIndex(self._config["INDEX_DIR"], self._fm,
+                                      self._config["INVERTED_INDEX"],
+                                      self._config["SEARCH_CACHE_SIZE"])
+        self.maintainer = IndexMaintainer(self._index)
+        self._ingest = IngestPipeline(self._bot.bot, self._index,
+                                      self._config["INGEST_WORKERS"],
+                                      self._config["INGEST_QUEUE_SIZE"])
+        self.job_logs = JobLogStore(
+            self._config["JOB_LOG_DIR"] or
+            path.join(self._config["INDEX_DIR"], self.JOB_LOG_DIR))
+        self.scheduler = Scheduler(
+            self._config["SCRIPT_DIR"], self._mq,
+            path.join(self._config["INDEX_DIR"], self.SCHEDULES_FILE),
+            job_logs=self.job_logs)
         # we use this to know if a file was already sent to telegram
         # and also it maps from our index's entry id to telegram's file id
         self._file_id_cache = {}
+        self._load_cache()
+        if self._config["STORAGE_CHAT"]:
+            self.prewarmer = Prewarmer(self._index, self._bot,
+                                       self._file_id_cache,
+                                       self._config["STORAGE_CHAT"],
+                                       self._config["PREWARM_BANDWIDTH"])
+        else:
+            self.prewarmer = None
         if getattr(self, 'doc_command', False):
             self._bot.register_handler(self.doc_command,
                                        content_types=[DOCUMENT])
@@ -47,18 +98,23 @@ class Commands(object):
             # make sure this is last to not override others
             self._bot.register_handler(self.default_command, content_types=ANY)
         self._all_unsubscribers = {}
-        self._load_cache()
 
     def _load_cache(self):
         if self._fm.contains(self.CACHE_FILE):
             log.info("Loading cache data")
-            self._file_id_cache = json.load(self._fm.get_file(self.CACHE_FILE))
+            # updated in place, the prewarmer shares the dictionary
+            self._file_id_cache.update(
+                json.load(self._fm.get_file(self.CACHE_FILE)))
 
     def _save_cache(self):
         log.info("Saving cache data")
         self._fm.write_content(self.CACHE_FILE,
                                json.dumps(self._file_id_cache).encode())
 
+    async def shutdown(self):
+        """ Finish the uploads in progress, call it before close """
+        await self._ingest.close(wait=True)
+
     def close(self):
         self._index.close()
         self._save_cache()
@@ -67,10 +123,120 @@ class Commands(object):
         parts = shlex.split(message["text"])
         command, args = parts[1], parts[2:]
         log.info("Executing command %s", command)
-        runner = Runner(self._config["SCRIPT_DIR"], command, args)
+        runner = Runner(self._config["SCRIPT_DIR"], command, args,
+                        self.job_logs)
         async for line in runner.work():
             await message.answer(line)
 
+    async def schedule_command(self, message):
+        usage = "Usage: /schedule [--topic=name] [--jitter=seconds] " \
+                "[--overlap] name spec script [args...]"
+        parts = shlex.split(message["text"])[1:]
+        options = {}
+        while parts and parts[0].startswith("--"):
+            key, _, value = parts.pop(0)[2:].partition("=")
+            options[key] = value
+        try:
+            jitter = float(options.get("jitter") or 0)
+        except ValueError:
+            jitter = -1
+        if len(parts) < 3 or jitter < 0 or \
+                not set(options).issubset(["topic", "jitter", "overlap"]):
+            await message.reply(usage)
+            return
+        name, spec, script, args = parts[0], parts[1], parts[2], parts[3:]
+        try:
+            schedule = Schedule(name, spec, script, args,
+                                options.get("topic"), jitter,
+                                "overlap" not in options)
+            self.scheduler.add(schedule)
+        except ValueError as e:
+            await message.reply(f"Invalid schedule: {e}")
+            return
+        except ScriptNotFound:
+            await message.reply(f"Script not found: {script}")
+            return
+        await message.reply(f"{name}: Scheduled, output sent to topic "
+                            f"{schedule.topic}")
+
+    async def unschedule_command(self, message):
+        name = " ".join(message['text'].split()[1:])
+        try:
+            self.scheduler.remove(name)
+        except KeyError:
+            await message.reply(f"{name}: Schedule not found")
+            return
+        await message.reply(f"{name}: Unscheduled")
+
+    async def schedules_command(self, message):
+        lines = []
+        for schedule in sorted(self.scheduler.schedules.values(),
+                               key=lambda schedule: schedule.next_run):
+            next_run = time.strftime("%Y-%m-%d %H:%M:%S",
+                                     time.localtime(schedule.next_run))
+            running = " (running)" \
+                if self.scheduler.is_running(schedule.name) else ""
+            lines.append(f"{schedule.name}: {schedule.spec_text} "
+                         f"{schedule.script} {' '.join(schedule.args)} "
+                         f"-> {schedule.topic}, next {next_run}{running}")
+        await message.reply("\n".join(lines) or "No schedules")
+
+    async def _answer_lines(self, message, lines):
+        """ Answer with as many messages as needed for the lines """
+        text = ""
+        for line in lines:
+            line = line[:self.MAX_MESSAGE_LENGTH - 1]
+            if len(text) + len(line) + 1 > self.MAX_MESSAGE_LENGTH:
+                await message.answer(text)
+                text = ""
+            text += line.rstrip("\n") + "\n"
+        if text:
+            await message.answer(text)
+
+    async def tail_command(self, message):
+        args = message['text'].split()[1:]
+        try:
+            job_id = args[0]
+            count = int(args[1]) if len(args) > 1 else 20
+        except (IndexError, ValueError):
+            await message.reply("Usage: /tail job [lines]")
+            return
+        count = max(1, min(count, self.MAX_TAIL_LINES))
+        loop = asyncio.get_running_loop()
+        try:
+            # big logs take a while to decompress
+            lines = await loop.run_in_executor(None, self.job_logs.tail,
+                                               job_id, count)
+        except KeyError as e:
+            await message.reply(f"Error: {e}")
+            return
+        await self._answer_lines(message, lines or ["No output"])
+
+    async def grep_command(self, message):
+        args = message['text'].split(maxsplit=2)[1:]
+        if len(args) != 2:
+            await message.reply("Usage: /grep job pattern")
+            return
+        job_id, pattern = args
+        loop = asyncio.get_running_loop()
+        suffix = []
+        try:
+            matches = await loop.run_in_executor(
+                None, functools.partial(self.job_logs.grep, job_id, pattern,
+                                        seconds=self.GREP_SECONDS))
+        except KeyError as e:
+            await message.reply(f"Error: {e}")
+            return
+        except re.error as e:
+            await message.reply(f"Invalid pattern: {e}")
+            return
+        except GrepTimeout as e:
+            matches = e.matches
+            suffix = [f"Search stopped after {self.GREP_SECONDS}s"]
+        await self._answer_lines(
+            message, [f"{number}: {line}" for number, line in matches]
+            + suffix or ["No match"])
+
     async def join_command(self, message):
         args = message['text'].split()[1:]
         topic = " ".join(args)
@@ -108,76 +274,169 @@ class Commands(object):
 
     async def doc_command(self, message):
         if message.document:
-            await self._download_and_index(message.document.file_id,
-                                           message.document.file_name,
-                                           message.caption,
-                                           message.reply,
-                                           DOCUMENT)
+            await self._ingest.submit(Upload(message.document.file_id,
+                                             message.document.file_name,
+                                             message.caption,
+                                             message.reply,
+                                             message.media_group_id))
 
     async def video_command(self, message):
         if message.video:
-            await self._download_and_index(message.video.file_id,
-                                           message.video.file_id,
-                                           message.caption,
-                                           message.reply,
-                                           VIDEO)
-
-    async def _download_and_index(self, file_id, file_name, caption, callback,
-                                  content_type=None):
-        if content_type is None:
-            content_type = DOCUMENT
-        file_io = BytesIO()
+            await self._ingest.submit(Upload(message.video.file_id,
+                                             message.video.file_id,
+                                             message.caption,
+                                             message.reply,
+                                             message.media_group_id))
+
+    async def _send_with_retry(self, func, *args):
+        for retry in range(self.SEND_RETRIES):
+            try:
+                return await func(*args)
+            except RetryAfter as e:
+                if retry == self.SEND_RETRIES - 1:
+                    raise
+                log.info("Rate limited, retrying in %d s", e.timeout)
+                await asyncio.sleep(e.timeout)
+
+    async def _send_entry(self, chat_id, entry, semaphore):
+        """ Send an entry alone, returns whether it was sent """
+        file_id = self._file_id_cache.get(entry.entry_id) or entry.extra
+        async with semaphore:
+            if file_id:
+                log.info("Found file id (%s, %s)", entry.entry_id, file_id)
+                sent = await self._send_with_retry(
+                    self._bot.bot.send_document, chat_id, file_id)
+            elif entry.entry_type == FILE_PRESENT:
+                log.info("Sending %s", entry.entry_id)
+                sent = await self._send_with_retry(
+                    self._bot.bot.send_document, chat_id,
+                    (entry.filename, self._index.get_file(entry.entry_id)))
+            else:
+                sent = False
+        if sent:
+            self._file_id_cache[entry.entry_id] = sent.document.file_id
+        return bool(sent)
+
+    async def _send_media_group(self, chat_id, entries, semaphore):
+        """ Send entries with known file ids, returns the ones not sent """
+        if len(entries) == 1:
+            sent = await self._send_entry(chat_id, entries[0], semaphore)
+            return [] if sent else entries
+        media = [InputMediaDocument(self._file_id_cache.get(entry.entry_id)
+                                    or entry.extra)
+                 for entry in entries]
         try:
-            dst = await self._bot.bot.download_file_by_id(file_id, file_io)
+            async with semaphore:
+                messages = await self._send_with_retry(
+                    self._bot.bot.send_media_group, chat_id, media)
         except Exception as e:
-            # we can still index without the content
-            msg = f"Error downloading file: {e}"
-            log.info(msg)
-            await callback(msg)
-        try:
-            entry = self._index.add_entry(file_name, caption,
-                                          file_io.getvalue(), file_id)
-            await callback(f"File indexed: {entry.entry_id}")
-        except FileExistsError as e:
-            await callback(f"{e}")
+            # one wrong file id makes the whole group fail, find it
+            log.info("Error sending media group, sending one by one: %s", e)
+            sent = await asyncio.gather(*[
+                self._send_entry(chat_id, entry, semaphore)
+                for entry in entries], return_exceptions=True)
+            return [entry for entry, ok in zip(entries, sent)
+                    if ok is not True]
+        for entry, sent in zip(entries, messages):
+            self._file_id_cache[entry.entry_id] = sent.document.file_id
+        return []
 
     async def search_command(self, message):
         args = message['text'].split()[1:]
         text = " ".join(args)
-        found = False
-        for entry in self._index.search(text):
-            found = True
-            file_id = self._file_id_cache.get(entry.entry_id)
-            if file_id:
-                log.info("Found cached entry (%s, %s)", entry.entry_id,
-                         file_id)
-                sent = await self._bot.bot.send_document(message.chat.id,
-                                                         file_id)
-            elif entry.extra:  # extra field is used for file_id
-                log.info("Found file id %s", entry.entry_id)
-                sent = await self._bot.bot.send_document(message.chat.id,
-                                                         entry.extra)
+        entries = await self._index.asearch(text)
+        if not entries:
+            await message.reply("No file found")
+            return
+        if self.prewarmer:
+            self.prewarmer.record_search(entries)
+        with_file_id = []
+        uploads = []
+        failed = []
+        for entry in entries:
+            if self._file_id_cache.get(entry.entry_id) or entry.extra:
+                with_file_id.append(entry)
             elif entry.entry_type == FILE_PRESENT:
-                log.info("Sending %s", entry.entry_id)
-                sent = await self._bot.bot.send_document(message.chat.id,
-                                                         (entry.filename,
-                                                          self._index.get_file(
-                                                              entry.entry_id)))
+                uploads.append(entry)
             else:
-                sent = False
-
-            if sent:
-                self._file_id_cache[entry.entry_id] = sent.document.file_id
+                failed.append(entry)
+        # files already in telegram are forwarded in groups, which needs
+        # far fewer requests than sending them one by one
+        groups = [with_file_id[i:i + self.MEDIA_GROUP_SIZE] for i in
+                  range(0, len(with_file_id), self.MEDIA_GROUP_SIZE)]
+        semaphore = asyncio.Semaphore(self.SEND_CONCURRENCY)
+        results = await asyncio.gather(
+            *[self._send_media_group(message.chat.id, group, semaphore)
+              for group in groups],
+            *[self._send_entry(message.chat.id, entry, semaphore)
+              for entry in uploads],
+            return_exceptions=True)
+        for group, result in zip(groups, results[:len(groups)]):
+            if isinstance(result, Exception):
+                log.error("Error sending media group: %s", result)
+                failed.extend(group)
             else:
-                msg = 'Error while sending %s' % entry.entry_id
-                log.error(msg)
-                await message.reply(msg)
-        if not found:
-            await message.reply("No file found")
+                failed.extend(result)
+        for entry, result in zip(uploads, results[len(groups):]):
+            if isinstance(result, Exception):
+                log.error("Error sending %s: %s", entry.entry_id, result)
+            if result is not True:
+                failed.append(entry)
+        for entry in failed:
+            msg = 'Error while sending %s' % entry.entry_id
+            log.error(msg)
+            await message.reply(msg)
+
+    async def delete_command(self, message):
+        args = message['text'].split()[1:]
+        if len(args) != 1:
+            await message.reply("Usage: /delete entry_id")
+            return
+        entry_id = args[0]
+        loop = asyncio.get_running_loop()
+        try:
+            # it waits for the maintenance if it is changing the index
+            await loop.run_in_executor(None, self._index.delete_entry,
+                                       entry_id)
+        except (KeyError, IndexError) as e:
+            await message.reply(f"Error deleting entry: {e}")
+            return
+        self._file_id_cache.pop(entry_id, None)
+        await message.reply(f"Entry deleted: {entry_id}")
+
+    async def maintenance_command(self, message):
+        await message.answer(
+            IndexMaintainer.format_report(self.maintainer.last_report))
 
     async def ping_command(self, message):
         await message.answer("pong")
 
+    async def stats_command(self, message):
+        await message.answer(registry.summary() or "No stats yet")
+
+    async def profile_command(self, message):
+        args = message['text'].split()[1:]
+        try:
+            seconds = float(args[0]) if args else 10
+        except ValueError:
+            seconds = -1
+        if not 0 < seconds <= MAX_SECONDS:
+            await message.reply(f"Usage: /profile [seconds], up to "
+                                f"{MAX_SECONDS}")
+            return
+        await message.reply(f"Profiling for {seconds:g} s")
+        try:
+            result = await profile(seconds)
+        except ProfileInProgress as e:
+            await message.reply(f"{e}")
+            return
+        await self._bot.bot.send_document(
+            message.chat.id,
+            ("profile-report.txt", BytesIO(result.report().encode())))
+        await self._bot.bot.send_document(
+            message.chat.id,
+            ("profile.folded", BytesIO(result.collapsed().encode())))
+
     async def default_command(self, message):
         # for logging purposes
         pass
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+""" Client library to publish messages to hirnoty topics
+
+Example:
+    from hirnoty.client import Client
+
+    with Client() as client:
+        client.send("alerts", "disk almost full")
+
+Messages to the same topic can be batched, with linger > 0 they are kept
+for up to linger seconds (or until max_batch messages) and then sent
+joined by new lines as a single message.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+import weakref
+
+import zmq
+import zmq.asyncio
+
+log = logging.getLogger(__name__)
+
+# sync sockets shared by all the clients of the process, by address
+_sockets = {}
+_sockets_lock = threading.Lock()
+_clients = weakref.WeakSet()
+
+
+def get_connect_address():
+    # the configuration is loaded only when needed, it execs every config
+    # file, which is expensive for short lived producers
+    from hirnoty.settings import config
+    return config["CONNECT_ADDRESS"]
+
+
+def _get_socket(addr):
+    with _sockets_lock:
+        socket = _sockets.get(addr)
+        if socket is None:
+            socket = zmq.Context.instance().socket(zmq.PUSH)
+            socket.connect(f"tcp://{addr}")
+            _sockets[addr] = socket
+        return socket
+
+
+def _encode(topic, messages):
+    return [topic.encode("utf-8"), "\n".join(messages).encode("utf-8")]
+
+
+@atexit.register
+def _flush_all():
+    for client in list(_clients):
+        client.flush()
+
+
+class _Batcher(object):
+    def __init__(self, linger, max_batch):
+        self.linger = linger
+        self.max_batch = max_batch
+        self.pending = {}
+        self.count = 0
+        self.oldest = None
+
+    def add(self, topic, msg):
+        """ Add a message and return True if the batch is full """
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.setdefault(topic, []).append(msg)
+        self.count += 1
+        return self.count >= self.max_batch
+
+    def take(self):
+        pending = self.pending
+        self.pending = {}
+        self.count = 0
+        self.oldest = None
+        return pending
+
+
+class Client(object):
+    """ Publish messages to hirnoty topics
+
+    Args:
+        addr: IP and port of hirnoty using format IP:PORT, defaults to
+            CONNECT_ADDRESS of the configuration
+        linger: seconds messages can wait to be batched, 0 sends each
+            message as soon as it is published
+        max_batch: number of messages that triggers a flush
+    """
+    def __init__(self, addr=None, linger=0.0, max_batch=100):
+        self.addr = addr
+        self._socket = None
+        self._batcher = _Batcher(linger, max_batch)
+        self._lock = threading.Lock()
+        self._timer = None
+        _clients.add(self)
+
+    def _get_socket(self):
+        if self._socket is None:
+            if self.addr is None:
+                self.addr = get_connect_address()
+            self._socket = _get_socket(self.addr)
+        return self._socket
+
+    def send(self, topic, msg):
+        if not self._batcher.linger:
+            socket = self._get_socket()
+            with _sockets_lock:
+                socket.send_multipart(_encode(topic, [msg]))
+            return
+        with self._lock:
+            full = self._batcher.add(topic, msg)
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self._batcher.linger,
+                                              self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending = self._batcher.take()
+        if not pending:
+            return
+        socket = self._get_socket()
+        with _sockets_lock:
+            for topic, messages in pending.items():
+                socket.send_multipart(_encode(topic, messages))
+
+    def close(self):
+        # the socket is shared with other clients, so it is kept open
+        self.flush()
+        _clients.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncClient(object):
+    """ asyncio version of Client
+
+    Each AsyncClient owns its socket, as asyncio sockets can't be shared
+    across event loops, create it once and reuse it.
+    """
+    def __init__(self, addr=None, linger=0.0, max_batch=100):
+        self.addr = addr
+        self._socket = None
+        self._context = None
+        self._batcher = _Batcher(linger, max_batch)
+        self._flush_handle = None
+
+    def _get_socket(self):
+        if self._socket is None:
+            if self.addr is None:
+                self.addr = get_connect_address()
+            self._context = zmq.asyncio.Context.instance()
+            self._socket = self._context.socket(zmq.PUSH)
+            self._socket.connect(f"tcp://{self.addr}")
+        return self._socket
+
+    async def send(self, topic, msg):
+        if not self._batcher.linger:
+            await self._get_socket().send_multipart(_encode(topic, [msg]))
+            return
+        if self._batcher.add(topic, msg):
+            await self.flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self._batcher.linger,
+                lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending = self._batcher.take()
+        if not pending:
+            return
+        socket = self._get_socket()
+        for topic, messages in pending.items():
+            await socket.send_multipart(_encode(topic, messages))
+
+    async def close(self):
+        await self.flush()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
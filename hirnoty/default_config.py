@@ -9,3 +9,14 @@ CONNECT_ADDRESS = "127.0.0.1:1234"
 OTP = None
 LOGLEVEL = 'info'
 INVERTED_INDEX = False
+SEARCH_CACHE_SIZE = 128
+INDEX_SHARDS = None
+MAINTENANCE_INTERVAL = 3600
+STORAGE_CHAT = None
+INGEST_WORKERS = {"download": 4, "hash": 1, "compress": 2, "index": 1}
+INGEST_QUEUE_SIZE = 4
+JOB_LOG_DIR = None
+PREWARM_BANDWIDTH = 1024 ** 2
+METRICS_ADDRESS = None
+RECORD_PATH = None
+API_SERVER = None
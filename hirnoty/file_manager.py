@@ -1,6 +1,22 @@
 import io
+import re
 import zlib
-from os import access, path, R_OK
+from os import access, listdir, path, remove, stat, R_OK
+
+from hirnoty.metrics import registry
+
+_bytes_read = registry.counter("hirnoty_file_bytes_total",
+                               "Uncompressed bytes through the file manager",
+                               direction="read")
+_bytes_written = registry.counter("hirnoty_file_bytes_total",
+                                  "Uncompressed bytes through the file "
+                                  "manager",
+                                  direction="write")
+_stored_bytes_written = registry.counter("hirnoty_file_stored_bytes_total",
+                                         "Compressed bytes written to disk")
+
+
+ENTRY_ID_RE = re.compile("^[a-f0-9]{64}$")
 
 
 class FileManager(object):
@@ -8,6 +24,16 @@ class FileManager(object):
     def __init__(self, path):
         self.path = path
 
+    def list_ids(self):
+        # only files named as index entries, other files are ignored
+        return [name for name in listdir(self.path)
+                if ENTRY_ID_RE.match(name)]
+
+    def stat(self, entry_id):
+        if not entry_id:
+            raise IOError("Invalid file id")
+        return stat(path.join(self.path, entry_id))
+
     def contains(self, entry_id):
         if not entry_id:
             return False
@@ -24,6 +50,19 @@ class FileManager(object):
         with open(path.join(self.path, entry_id), 'wb') as fhandle:
             fhandle.write(content)
 
+    def append_content(self, entry_id, content):
+        if not entry_id:
+            raise IOError("Invalid file id")
+        with open(path.join(self.path, entry_id), 'ab') as fhandle:
+            fhandle.write(content)
+
+    def read_range(self, entry_id, offset, length):
+        if not entry_id:
+            raise IOError("Invalid file id")
+        with open(path.join(self.path, entry_id), 'rb') as fhandle:
+            fhandle.seek(offset)
+            return fhandle.read(length)
+
     def make_read_only(self, entry_id):
         if not entry_id:
             raise IOError("Invalid file id")
@@ -35,6 +74,14 @@ class FileManager(object):
         with open(path.join(self.path, entry_id), "rb") as fhandle:
             return fhandle.read()
 
+    def remove(self, entry_id):
+        if not entry_id:
+            raise IOError("Invalid file id")
+        try:
+            remove(path.join(self.path, entry_id))
+        except FileNotFoundError:
+            pass
+
 
 class CompressingFileManager(object):
     # This class manages files based on a file id
@@ -44,15 +91,36 @@ class CompressingFileManager(object):
     def contains(self, entry_id):
         return self._fm.contains(entry_id)
 
+    def list_ids(self):
+        return self._fm.list_ids()
+
+    def stat(self, entry_id):
+        return self._fm.stat(entry_id)
+
     def get_file(self, entry_id):
-        with self._fm.get_file(entry_id) as fhandle:
-            return io.BytesIO(zlib.decompress(fhandle.read()))
+        return io.BytesIO(self.read_content(entry_id))
 
     def write_content(self, entry_id, content):
-        return self._fm.write_content(entry_id, zlib.compress(content))
+        compressed = zlib.compress(content)
+        _bytes_written.inc(len(content))
+        _stored_bytes_written.inc(len(compressed))
+        return self._fm.write_content(entry_id, compressed)
 
     def make_read_only(self, entry_id):
         return self._fm.make_read_only(entry_id)
 
     def read_content(self, entry_id):
-        return zlib.decompress(self._fm.read_content(entry_id))
+        content = zlib.decompress(self._fm.read_content(entry_id))
+        _bytes_read.inc(len(content))
+        return content
+
+    def read_raw(self, entry_id):
+        # compressed content, to copy files without recompressing them
+        return self._fm.read_content(entry_id)
+
+    def write_raw(self, entry_id, raw_content):
+        _stored_bytes_written.inc(len(raw_content))
+        return self._fm.write_content(entry_id, raw_content)
+
+    def remove(self, entry_id):
+        return self._fm.remove(entry_id)
@@ -3,14 +3,26 @@ import json
 import hashlib
 import logging
 import re
+import threading
 import zlib
-from collections import namedtuple
-from os import path, access, R_OK
+from collections import namedtuple, OrderedDict
+from contextlib import nullcontext
+from os import path, access, fsync, replace, R_OK
 
 from hirnoty.file_manager import CompressingFileManager
+from hirnoty.metrics import registry
 from hirnoty.utils import create_file
 
 log = logging.getLogger(__name__)
+_search_latency = registry.histogram("hirnoty_index_search_seconds",
+                                     "Time spent searching the index")
+_add_latency = registry.histogram("hirnoty_index_add_seconds",
+                                  "Time spent adding entries to the index")
+_cache_hits = registry.counter("hirnoty_index_cache_total",
+                               "Searches by query cache result", result="hit")
+_cache_misses = registry.counter("hirnoty_index_cache_total",
+                                 "Searches by query cache result",
+                                 result="miss")
 # Separators for the index entry
 # they should be different
 SEP_FIELDS = "|"
@@ -23,10 +35,13 @@ IndexEntry = namedtuple("IndexEntry", ["entry_type", "entry_id", "filename",
 
 FILE_ABSENT = "A"
 FILE_PRESENT = "P"
+# tombstone, the entry with the same id was deleted
+FILE_DELETED = "D"
 
 
 class SimpleIndex(object):
-    def __init__(self, meta_dir, fm=None, use_inverted_index=False):
+    def __init__(self, meta_dir, fm=None, use_inverted_index=False,
+                 cache_size=128):
         self.meta_dir = meta_dir
         if fm:
             self.fm = fm
@@ -39,6 +54,17 @@ class SimpleIndex(object):
             self.engine = InvertedIndexSearch(self.meta_path, self.fm)
         else:
             self.engine = LinearSearch(self.meta_path, self.fm)
+        # serialises changes made from other threads (e.g. maintenance)
+        self.lock = threading.RLock()
+        self._init_cache(cache_size)
+
+    def _init_cache(self, cache_size):
+        # bumped on every change, cached search results of older
+        # generations are discarded
+        self.generation = 0
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_generation = 0
 
     @staticmethod
     def _verify_entry_id(entry_id):
@@ -54,11 +80,138 @@ class SimpleIndex(object):
         self._verify_entry_id(entry_id)
         return self.fm.get_file(entry_id)
 
+    def contains(self, entry_id):
+        return self.engine.contains(entry_id)
+
+    def entries(self):
+        return self.engine.entries()
+
+    def parts(self):
+        """ Indexes with their own metadata and files composing this one """
+        return [self]
+
+    def delete_entry(self, entry_id):
+        """ Delete an entry adding a tombstone to the metadata
+
+        Its file is removed later by the maintenance
+        """
+        self._verify_entry_id(entry_id)
+        with self.lock:
+            if not self.engine.contains(entry_id):
+                raise KeyError(f"Entry {entry_id} not found")
+            self.engine.delete_entry(entry_id)
+        self.generation += 1
+
+    @property
+    def dead_entries(self):
+        """ Lines of the metadata file that compaction would remove """
+        return self.engine.dead_lines
+
+    def compact(self, lock=None):
+        """ Rewrite the metadata file without deleted entries
+
+        Args:
+            lock: lock serialising the changes, defaults to the one of
+                this index
+        Returns:
+            number of lines removed
+        """
+        return self.engine.compact(lock or self.lock)
+
+    @staticmethod
+    def _normalize_query(text):
+        return " ".join(text.split())
+
+    def _cached(self, key):
+        if not self._cache_size:
+            return None
+        if self._cache_generation != self.generation:
+            self._cache.clear()
+            self._cache_generation = self.generation
+        result = self._cache.get(key)
+        if result is not None:
+            _cache_hits.inc()
+            self._cache.move_to_end(key)
+            return list(result)
+        _cache_misses.inc()
+        return None
+
+    def _store(self, key, result):
+        if not self._cache_size:
+            return
+        self._cache[key] = tuple(result)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
     def search(self, text):
+        key = self._normalize_query(text)
+        result = self._cached(key)
+        if result is not None:
+            return result
+        with _search_latency.time():
+            result = self._search(key)
+        self._store(key, result)
+        return result
+
+    async def asearch(self, text):
+        """ Same as search, for the event loop
+
+        Parts that are slow to search are searched without blocking it.
+        """
+        key = self._normalize_query(text)
+        result = self._cached(key)
+        if result is not None:
+            return result
+        with _search_latency.time():
+            result = await self._asearch(key)
+        self._store(key, result)
+        return result
+
+    def _search(self, text):
         return self.engine.search(text)
 
+    async def _asearch(self, text):
+        return self._search(text)
+
     def add_entry(self, filename, keywords, content="", extra=""):
-        return self.engine.add_entry(filename, keywords, content, extra)
+        with _add_latency.time(), self.lock:
+            entry = self.engine.add_entry(filename, keywords, content, extra)
+        self.generation += 1
+        return entry
+
+    def add_compressed(self, entry, raw_content):
+        """ Add an entry whose id and compressed content are already known
+
+        Raises:
+            FileExistsError if the entry was already added
+        """
+        with _add_latency.time(), self.lock:
+            if self.contains(entry.entry_id):
+                raise FileExistsError("File already added")
+            self.insert_entry(entry, raw_content)
+        return entry
+
+    def insert_entry(self, entry, raw_content):
+        """ Insert an existing entry, with its content already compressed """
+        self.fm.write_raw(entry.entry_id, raw_content)
+        self.engine.insert_entry(entry)
+        self.generation += 1
+
+    def remove_entries(self, entry_ids, lock=None):
+        """ Remove entries and their files rewriting the metadata
+
+        Args:
+            entry_ids: ids of the entries removed
+            lock: lock serialising the changes, defaults to the one of
+                this index
+        """
+        lock = lock or self.lock
+        entry_ids = set(entry_ids)
+        self.engine.remove_entries(entry_ids, lock)
+        with lock:
+            for entry_id in entry_ids:
+                self.fm.remove(entry_id)
+        self.generation += 1
 
 
 def load_index_entry(line):
@@ -82,6 +235,62 @@ def dump_index_entry(entry):
     return f"{SEP_FIELDS.join(entry)}{SEP_ENTRY}"
 
 
+def make_entry(filename, keywords, content="", extra=""):
+    keywords = keywords.strip() if keywords else ""
+    filename = filename.strip() if filename else ""
+    if content:
+        entry_type = FILE_PRESENT
+    else:
+        entry_type = FILE_ABSENT
+    entry_id = _calculate_entry_id(filename, keywords, content, extra)
+    return IndexEntry(entry_type, entry_id, filename, keywords, extra)
+
+
+def rewrite_metadata(engine, entry_ids, lock=None):
+    """ Atomically replace the metadata of a search engine without entries
+
+    The new file and the new data in memory are built without holding the
+    lock, which is only held to copy the lines added in the meantime and to
+    swap the data, so the changes are not blocked during the rewrite.
+
+    Args:
+        engine: LinearSearch or InvertedIndexSearch
+        entry_ids: ids of the entries left out
+        lock: lock serialising the changes of the engine
+    """
+    lock = lock or nullcontext()
+    metadata_path = engine.metadata_path
+    tmp_path = metadata_path + ".tmp"
+    # a compaction and a rebalance can't rewrite the same file at once
+    with engine.rewrite_lock:
+        with lock:
+            engine.metadata_file.flush()
+            offset = path.getsize(metadata_path)
+            entries = [entry for entry in engine.entries()
+                       if entry.entry_id not in entry_ids]
+        with open(tmp_path, 'w') as fhandle:
+            for entry in entries:
+                fhandle.write(dump_index_entry(entry))
+            fhandle.flush()
+            fsync(fhandle.fileno())
+        state = engine.build_state(entries)
+        with lock:
+            with open(metadata_path, 'rb') as fhandle:
+                fhandle.seek(offset)
+                added = fhandle.read().decode()
+            with open(tmp_path, 'a') as fhandle:
+                fhandle.write(added)
+                fhandle.flush()
+                fsync(fhandle.fileno())
+            engine.metadata_file.close()
+            replace(tmp_path, metadata_path)
+            engine.set_state(state)
+            for line in added.split(SEP_ENTRY):
+                if line:
+                    engine.apply(load_index_entry(line))
+            engine.metadata_file = open(metadata_path, 'a')
+
+
 def _calculate_entry_id(filename, keywords, content=b"", extra=""):
     if content:
         return hashlib.sha256(content).hexdigest()
@@ -91,10 +300,29 @@ def _calculate_entry_id(filename, keywords, content=b"", extra=""):
             .encode()).hexdigest()
 
 
+def _apply_tombstones(lines):
+    """ Return the entries alive after replaying the metadata lines """
+    alive = {}
+    for line in lines:
+        if not line:
+            continue
+        entry = load_index_entry(line)
+        if entry.entry_type == FILE_DELETED:
+            alive.pop(entry.entry_id, None)
+        else:
+            alive[entry.entry_id] = entry
+    return list(alive.values())
+
+
+def _tombstone(entry_id):
+    return IndexEntry(FILE_DELETED, entry_id, "", "", "")
+
+
 class LinearSearch(object):
     def __init__(self, metadata_path, fm):
         self.metadata_path = metadata_path
         self.fm = fm
+        self.rewrite_lock = threading.Lock()
         self.load_data()
 
     def close(self):
@@ -102,7 +330,25 @@ class LinearSearch(object):
 
     def load_data(self):
         with open(self.metadata_path, 'r') as fhandle:
-            self.metadata = io.StringIO(fhandle.read())
+            content = fhandle.read()
+        # ids deleted whose file might still be there
+        deleted = set()
+        dead_lines = 0
+        if content.startswith(FILE_DELETED + SEP_FIELDS) or \
+                f"{SEP_ENTRY}{FILE_DELETED}{SEP_FIELDS}" in content:
+            lines = content.split(SEP_ENTRY)
+            entries = _apply_tombstones(lines)
+            dead_lines = len([line for line in lines if line]) - len(entries)
+            alive = set(entry.entry_id for entry in entries)
+            deleted = set(load_index_entry(line).entry_id
+                          for line in lines if line) - alive
+            content = "".join(dump_index_entry(entry) for entry in entries)
+        metadata = io.StringIO()
+        metadata.write(content)
+        # searches in other threads see the old data until this is complete
+        self.deleted = deleted
+        self.dead_lines = dead_lines
+        self.metadata = metadata
         # keep it open to add new data
         self.metadata_file = open(self.metadata_path, 'a')
 
@@ -125,27 +371,76 @@ class LinearSearch(object):
             result.append(entry)
         return result
 
-    def add_entry(self, filename, keywords, content="", extra=""):
-        keywords = keywords.strip() if keywords else ""
-        filename = filename.strip() if filename else ""
-        if content:
-            entry_type = FILE_PRESENT
-        else:
-            entry_type = FILE_ABSENT
-        entry_id = _calculate_entry_id(filename, keywords, content, extra)
-        if self.fm.contains(entry_id):
-            raise FileExistsError("File already added")
-        entry = IndexEntry(entry_type, entry_id, filename, keywords, extra)
-        raw_entry = dump_index_entry(entry)
+    def contains(self, entry_id):
+        return entry_id not in self.deleted and self.fm.contains(entry_id)
+
+    def entries(self):
+        for line in self.metadata.getvalue().split(SEP_ENTRY):
+            if line:
+                yield load_index_entry(line)
+
+    def build_state(self, entries):
+        """ Data in memory for a metadata file with the given entries """
+        metadata = io.StringIO()
+        metadata.write("".join(dump_index_entry(entry) for entry in entries))
+        return metadata
+
+    def set_state(self, metadata):
+        # deleted ids are kept, their files might still be there
+        self.metadata = metadata
+        self.dead_lines = 0
+
+    def apply(self, entry):
+        """ Apply a metadata line to the data in memory """
+        if entry.entry_type == FILE_DELETED:
+            self._forget(entry.entry_id)
+            return
+        self.deleted.discard(entry.entry_id)
+        self.metadata.write(dump_index_entry(entry))
+
+    def insert_entry(self, entry):
         # write to memory buffer
-        self.metadata.write(raw_entry)
+        self.apply(entry)
         # update metadata file
-        self.metadata_file.write(raw_entry)
+        self.metadata_file.write(dump_index_entry(entry))
         self.metadata_file.flush()
+
+    def add_entry(self, filename, keywords, content="", extra=""):
+        entry = make_entry(filename, keywords, content, extra)
+        if self.contains(entry.entry_id):
+            raise FileExistsError("File already added")
+        self.insert_entry(entry)
         # write file with content
-        self.fm.write_content(entry_id, content)
+        self.fm.write_content(entry.entry_id, content)
         return entry
 
+    def delete_entry(self, entry_id):
+        self.metadata_file.write(dump_index_entry(_tombstone(entry_id)))
+        self.metadata_file.flush()
+        self._forget(entry_id)
+
+    def _forget(self, entry_id):
+        prefix_length = len(FILE_PRESENT + SEP_FIELDS)
+        content = "".join(
+            f"{line}{SEP_ENTRY}"
+            for line in self.metadata.getvalue().split(SEP_ENTRY)
+            if line and line[prefix_length:prefix_length + len(entry_id)]
+            != entry_id)
+        metadata = io.StringIO()
+        metadata.write(content)
+        self.metadata = metadata
+        self.deleted.add(entry_id)
+        # the entry line and the tombstone
+        self.dead_lines += 2
+
+    def remove_entries(self, entry_ids, lock=None):
+        rewrite_metadata(self, entry_ids, lock)
+
+    def compact(self, lock=None):
+        dead_lines = self.dead_lines
+        self.remove_entries(set(), lock)
+        return dead_lines
+
 
 class InvertedIndexSearch(object):
     BLACKLISTED_WORDS = set(["pdf", "zip", "", "\n"])
@@ -153,8 +448,7 @@ class InvertedIndexSearch(object):
     def __init__(self, metadata_path, fm):
         self.metadata_path = metadata_path
         self.fm = fm
-        self.inv_index = {}
-        self.entry_id_index = {}
+        self.rewrite_lock = threading.Lock()
         self.load_data()
 
     def close(self):
@@ -164,48 +458,116 @@ class InvertedIndexSearch(object):
     def split(text):
         return [item.strip() for item in re.split(r"[\n.,_\-\s]", text)]
 
+    def _words(self, entry):
+        return [word for word in
+                self.split(entry.filename) + self.split(entry.keywords)
+                if word not in self.BLACKLISTED_WORDS]
+
     def _insert_to_inv_index(self, entry):
         self.entry_id_index[entry.entry_id] = entry
-        for word in self.split(entry.filename) + self.split(entry.keywords):
-            if word not in self.BLACKLISTED_WORDS:
-                self.inv_index.setdefault(word, []).append(entry.entry_id)
+        for word in self._words(entry):
+            self.inv_index.setdefault(word, []).append(entry.entry_id)
+
+    def _remove_from_inv_index(self, entry_id):
+        entry = self.entry_id_index.pop(entry_id, None)
+        if entry is None:
+            return
+        for word in self._words(entry):
+            entry_ids = self.inv_index.get(word, [])
+            while entry_id in entry_ids:
+                entry_ids.remove(entry_id)
 
     def load_data(self):
+        entry_id_index = {}
+        dead_lines = 0
         with open(self.metadata_path, 'r') as fhandle:
             for line in fhandle:
                 entry = load_index_entry(line[:-1])
-                self._insert_to_inv_index(entry)
+                if entry.entry_type == FILE_DELETED:
+                    entry_id_index.pop(entry.entry_id, None)
+                    dead_lines += 2
+                else:
+                    entry_id_index[entry.entry_id] = entry
+        inv_index = {}
+        for entry in entry_id_index.values():
+            for word in self._words(entry):
+                inv_index.setdefault(word, []).append(entry.entry_id)
+        # searches in other threads keep using the old dictionaries until
+        # the new ones are complete, ids missing in entry_id_index are
+        # skipped by them, so it is replaced first
+        self.entry_id_index = entry_id_index
+        self.inv_index = inv_index
+        self.dead_lines = dead_lines
         # keep it open to add new data
         self.metadata_file = open(self.metadata_path, 'a')
 
-    def add_entry(self, filename, keywords, content="", extra=""):
-        keywords = keywords.strip() if keywords else ""
-        filename = filename.strip() if filename else ""
-        if content:
-            entry_type = FILE_PRESENT
+    def contains(self, entry_id):
+        return entry_id in self.entry_id_index
+
+    def entries(self):
+        return list(self.entry_id_index.values())
+
+    def build_state(self, entries):
+        """ Data in memory for a metadata file with the given entries """
+        entry_id_index = {}
+        inv_index = {}
+        for entry in entries:
+            entry_id_index[entry.entry_id] = entry
+            for word in self._words(entry):
+                inv_index.setdefault(word, []).append(entry.entry_id)
+        return entry_id_index, inv_index
+
+    def set_state(self, state):
+        self.entry_id_index, self.inv_index = state
+        self.dead_lines = 0
+
+    def apply(self, entry):
+        """ Apply a metadata line to the data in memory """
+        if entry.entry_type == FILE_DELETED:
+            self._remove_from_inv_index(entry.entry_id)
+            self.dead_lines += 2
         else:
-            entry_type = FILE_ABSENT
-        entry_id = _calculate_entry_id(filename, keywords, content, extra)
-        if entry_id in self.entry_id_index:
-            raise FileExistsError("File already added")
-        entry = IndexEntry(entry_type, entry_id, filename, keywords, extra)
-        self._insert_to_inv_index(entry)
+            self._insert_to_inv_index(entry)
+
+    def insert_entry(self, entry):
+        self.apply(entry)
         # update metadata file
         self.metadata_file.write(dump_index_entry(entry))
         self.metadata_file.flush()
+
+    def add_entry(self, filename, keywords, content="", extra=""):
+        entry = make_entry(filename, keywords, content, extra)
+        if entry.entry_id in self.entry_id_index:
+            raise FileExistsError("File already added")
+        self.insert_entry(entry)
         # write file with content
-        self.fm.write_content(entry_id, content)
+        self.fm.write_content(entry.entry_id, content)
         return entry
 
+    def delete_entry(self, entry_id):
+        self.metadata_file.write(dump_index_entry(_tombstone(entry_id)))
+        self.metadata_file.flush()
+        self.apply(_tombstone(entry_id))
+
+    def remove_entries(self, entry_ids, lock=None):
+        rewrite_metadata(self, entry_ids, lock)
+
+    def compact(self, lock=None):
+        dead_lines = self.dead_lines
+        self.remove_entries(set(), lock)
+        return dead_lines
+
     def search(self, text):
         text = text.strip()
+        inv_index = self.inv_index
+        entry_id_index = self.entry_id_index
         acc = set()
         first = True
         for keyword in self.split(text):
-            entry_ids = self.inv_index.get(keyword, [])
+            entry_ids = inv_index.get(keyword, [])
             if first:
                 acc = acc.union(set(entry_ids))
             else:
                 acc = acc.intersection(set(entry_ids))
             first = False
-        return [self.entry_id_index[i] for i in acc]
+        return [entry_id_index[i] for i in acc if i in entry_id_index]
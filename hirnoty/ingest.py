@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import zlib
+from io import BytesIO
+
+from hirnoty.index import make_entry
+from hirnoty.metrics import registry
+
+log = logging.getLogger(__name__)
+_ingested = registry.counter("hirnoty_ingest_files_total",
+                             "Files through the ingest pipeline")
+_duplicated = registry.counter("hirnoty_ingest_duplicated_total",
+                               "Files ingested that were already indexed")
+_ingest_latency = registry.histogram("hirnoty_ingest_seconds",
+                                     "Time from upload to indexed")
+
+STAGES = ("download", "hash", "compress", "index")
+DEFAULT_WORKERS = {"download": 4, "hash": 1, "compress": 2, "index": 1}
+
+
+class Upload(object):
+    """ File sent to the bot to be indexed
+
+    Args:
+        file_id: telegram file id
+        file_name: name of the file
+        caption: keywords of the file
+        reply: coroutine function used to answer
+        media_group_id: album of the upload, uploads of the same album share
+            the caption and get a single reply
+    """
+    def __init__(self, file_id, file_name, caption, reply,
+                 media_group_id=None):
+        self.file_id = file_id
+        self.file_name = file_name
+        self.caption = caption
+        self.reply = reply
+        self.media_group_id = media_group_id
+        self.group = None
+        self.content = None
+        self.entry = None
+        self.raw_content = None
+        self.errors = []
+        self.result = None
+        self.start = None
+
+
+class _Group(object):
+    def __init__(self):
+        self.uploads = []
+        self.pending = 0
+        self.timer = None
+
+
+class IngestPipeline(object):
+    """ Downloads, hashes, compresses and indexes uploads
+
+    Each stage has its own workers and is connected to the next one by a
+    bounded queue, so a burst of uploads never has more than a few files in
+    memory and submitting blocks when the pipeline is full. Hashing first
+    lets files already indexed skip the compression.
+
+    Uploads of an album are kept until no new one arrives for group_wait
+    seconds, then they are sent with the caption of the album (telegram
+    puts it in only one of them).
+
+    Replies are sent by their own task, so a slow answer (e.g. a flood
+    wait) doesn't hold the stages.
+
+    Args:
+        bot: aiogram Bot used to download the files
+        index: index where the files are added
+        workers: dictionary from stage name to number of workers
+        queue_size: capacity of each queue between stages
+        group_wait: seconds to wait for more uploads of an album
+    """
+    def __init__(self, bot, index, workers=None, queue_size=4,
+                 group_wait=1.0):
+        self.bot = bot
+        self.index = index
+        self.workers = dict(DEFAULT_WORKERS, **(workers or {}))
+        self.queue_size = queue_size
+        self.group_wait = group_wait
+        self._queues = None
+        self._replies = None
+        self._tasks = []
+        self._groups = {}
+
+    def start(self):
+        self._queues = {stage: asyncio.Queue(self.queue_size)
+                        for stage in STAGES}
+        # replies are short texts, they are not bounded so they never
+        # stop the indexing
+        self._replies = asyncio.Queue()
+        self._tasks.append(asyncio.ensure_future(self._reply_worker()))
+        handlers = {"download": self._download, "hash": self._hash,
+                    "compress": self._compress, "index": self._index}
+        for stage in STAGES:
+            next_stage = STAGES[STAGES.index(stage) + 1] \
+                if stage != STAGES[-1] else None
+            for _ in range(self.workers[stage]):
+                self._tasks.append(asyncio.ensure_future(
+                    self._work(stage, handlers[stage], next_stage)))
+
+    async def close(self, wait=False):
+        """ Stop the workers
+
+        Args:
+            wait: index the uploads already submitted and send their
+                replies first, albums still receiving uploads included
+        """
+        for group in self._groups.values():
+            group.timer.cancel()
+        if wait and self._queues is not None:
+            for media_group_id in list(self._groups):
+                await self._submit_group(media_group_id)
+            # an upload leaves a queue once it is in the next one
+            for stage in STAGES:
+                await self._queues[stage].join()
+            await self._replies.join()
+        self._groups = {}
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = None
+        self._replies = None
+
+    async def submit(self, upload):
+        """ Queue an upload, waits while the pipeline is full """
+        if self._queues is None:
+            self.start()
+        upload.start = asyncio.get_running_loop().time()
+        if upload.media_group_id is None:
+            await self._queues["download"].put(upload)
+            return
+        group = self._groups.get(upload.media_group_id)
+        if group is None:
+            group = self._groups[upload.media_group_id] = _Group()
+        else:
+            group.timer.cancel()
+        upload.group = group
+        group.uploads.append(upload)
+        group.timer = asyncio.get_running_loop().call_later(
+            self.group_wait, self._group_ready, upload.media_group_id)
+
+    def _group_ready(self, media_group_id):
+        if self._queues is None:
+            return
+        self._tasks = [task for task in self._tasks if not task.done()]
+        self._tasks.append(asyncio.ensure_future(
+            self._submit_group(media_group_id)))
+
+    async def _submit_group(self, media_group_id):
+        group = self._groups.pop(media_group_id, None)
+        if group is None:
+            return
+        caption = next((upload.caption for upload in group.uploads
+                        if upload.caption), None)
+        group.pending = len(group.uploads)
+        for upload in group.uploads:
+            upload.caption = caption
+            await self._queues["download"].put(upload)
+
+    async def _work(self, stage, handler, next_stage):
+        queue = self._queues[stage]
+        while True:
+            upload = await queue.get()
+            try:
+                try:
+                    done = await handler(upload)
+                except Exception as e:
+                    log.error("Error in ingest stage %s: %s", stage, e)
+                    upload.result = f"Error indexing {upload.file_name}: {e}"
+                    done = True
+                if done or next_stage is None:
+                    self._finish(upload)
+                else:
+                    await self._queues[next_stage].put(upload)
+            finally:
+                queue.task_done()
+
+    async def _download(self, upload):
+        file_io = BytesIO()
+        try:
+            await self.bot.download_file_by_id(upload.file_id, file_io)
+        except Exception as e:
+            # we can still index without the content
+            log.info("Error downloading file: %s", e)
+            upload.errors.append(f"Error downloading file: {e}")
+            file_io = BytesIO()
+        upload.content = file_io.getvalue()
+
+    async def _hash(self, upload):
+        loop = asyncio.get_running_loop()
+        upload.entry = await loop.run_in_executor(
+            None, make_entry, upload.file_name, upload.caption,
+            upload.content, upload.file_id)
+        if self.index.contains(upload.entry.entry_id):
+            _duplicated.inc()
+            upload.result = "File already added"
+            return True
+
+    async def _compress(self, upload):
+        loop = asyncio.get_running_loop()
+        upload.raw_content = await loop.run_in_executor(
+            None, zlib.compress, upload.content)
+        # only the compressed copy is needed from now on
+        upload.content = None
+
+    async def _index(self, upload):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.index.add_compressed,
+                                       upload.entry, upload.raw_content)
+            upload.result = f"File indexed: {upload.entry.entry_id}"
+        except FileExistsError as e:
+            _duplicated.inc()
+            upload.result = f"{e}"
+        upload.raw_content = None
+
+    def _finish(self, upload):
+        _ingested.inc()
+        _ingest_latency.observe(asyncio.get_running_loop().time() -
+                                upload.start)
+        upload.content = upload.raw_content = None
+        if upload.group is None:
+            for error in upload.errors:
+                self._replies.put_nowait((upload.reply, error))
+            self._replies.put_nowait((upload.reply, upload.result))
+            return
+        upload.group.pending -= 1
+        if not upload.group.pending:
+            self._replies.put_nowait(
+                (upload.reply, self._summary(upload.group.uploads)))
+
+    async def _reply_worker(self):
+        while True:
+            reply, text = await self._replies.get()
+            try:
+                await reply(text)
+            except Exception as e:
+                log.error("Error replying to upload: %s", e)
+            finally:
+                self._replies.task_done()
+
+    @staticmethod
+    def _summary(uploads):
+        indexed = sum(1 for upload in uploads
+                      if upload.result.startswith("File indexed"))
+        lines = [f"{indexed} of {len(uploads)} files indexed"]
+        for upload in uploads:
+            lines.append(f"{upload.file_name}: {upload.result}")
+            lines.extend(f"{upload.file_name}: {error}"
+                         for error in upload.errors)
+        return "\n".join(lines)
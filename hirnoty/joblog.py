@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+from hirnoty.file_manager import FileManager
+from hirnoty.metrics import registry
+
+log = logging.getLogger(__name__)
+_lines = registry.counter("hirnoty_joblog_lines_total",
+                          "Job output lines archived")
+_stored = registry.counter("hirnoty_joblog_stored_bytes_total",
+                           "Compressed job output bytes written")
+
+LOG_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+# compressed offset, compressed length, first line, number of lines
+CHUNK = struct.Struct("<QIQI")
+STDOUT = b"O"
+STDERR = b"E"
+
+
+class GrepTimeout(Exception):
+    """ The search took too long, matches has the lines found until then """
+    def __init__(self, matches):
+        super().__init__("The search took too long")
+        self.matches = matches
+
+
+def _decode(record):
+    """ Turn a stored line into text, stderr lines are marked """
+    text = record[1:].decode("utf-8", "replace")
+    if record[:1] == STDERR:
+        return f"stderr: {text}"
+    return text
+
+
+class JobLog(object):
+    """ Output of a running job, archived in compressed chunks
+
+    Lines are compressed as a single raw deflate stream, which is fully
+    flushed every chunk_size bytes of output. A full flush resets the
+    compressor, so every chunk can be decompressed on its own and its
+    position is written to the index file. Only the current chunk, the
+    compressor state and the last lines are kept in memory.
+
+    The job writes from the event loop and readers flush it from other
+    threads, so both hold the lock.
+    """
+    def __init__(self, fm, job_id, chunk_size, ring_lines):
+        self.fm = fm
+        self.job_id = job_id
+        self.chunk_size = chunk_size
+        self.ring = deque(maxlen=ring_lines)
+        self.lock = threading.Lock()
+        self.lines = 0
+        self._offset = 0
+        self._chunk_start_line = 0
+        self._chunk_input = 0
+        self._pending = []
+        self._compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        self.fm.write_content(job_id + LOG_SUFFIX, b"")
+        self.fm.write_content(job_id + INDEX_SUFFIX, b"")
+
+    def write(self, line, stream=STDOUT):
+        """ Add a line (bytes) of output """
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        record = stream + line
+        with self.lock:
+            self.ring.append(record)
+            self._pending.append(self._compressor.compress(record))
+            self._chunk_input += len(record)
+            self.lines += 1
+            _lines.inc()
+            if self._chunk_input >= self.chunk_size:
+                self._flush()
+
+    def last_lines(self, count):
+        """ Last count lines in memory, None if not all of them are """
+        with self.lock:
+            if count > len(self.ring):
+                return None
+            return list(self.ring)[-count:]
+
+    def flush(self):
+        """ Close the current chunk and write it """
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.lines == self._chunk_start_line:
+            return
+        self._pending.append(self._compressor.flush(zlib.Z_FULL_FLUSH))
+        data = b"".join(self._pending)
+        self.fm.append_content(self.job_id + LOG_SUFFIX, data)
+        self.fm.append_content(
+            self.job_id + INDEX_SUFFIX,
+            CHUNK.pack(self._offset, len(data), self._chunk_start_line,
+                       self.lines - self._chunk_start_line))
+        _stored.inc(len(data))
+        self._offset += len(data)
+        self._chunk_start_line = self.lines
+        self._chunk_input = 0
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._compressor = None
+
+
+class JobLogStore(object):
+    """ Compressed logs of the jobs, looked up by job id
+
+    Args:
+        directory: where the logs are written
+        chunk_size: uncompressed bytes per independently readable chunk
+        ring_lines: last lines of each running job kept in memory
+        keep: number of job logs kept in disk, older ones are removed
+    """
+    def __init__(self, directory, chunk_size=64 * 1024, ring_lines=100,
+                 keep=200):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fm = FileManager(directory)
+        self.chunk_size = chunk_size
+        self.ring_lines = ring_lines
+        self.keep = keep
+        self.running = {}
+
+    def _check_job_id(self, job_id):
+        if not re.match(r"^[\w-]+$", job_id):
+            raise KeyError(f"Invalid job id {job_id}")
+        if not self.fm.contains(job_id + INDEX_SUFFIX):
+            raise KeyError(f"Job {job_id} not found")
+
+    def _remove_old(self):
+        logs = sorted((os.stat(os.path.join(self.directory, name)).st_mtime,
+                       name[:-len(LOG_SUFFIX)])
+                      for name in os.listdir(self.directory)
+                      if name.endswith(LOG_SUFFIX))
+        for _, job_id in logs[:max(0, len(logs) - self.keep)]:
+            if job_id in self.running:
+                continue
+            for suffix in (LOG_SUFFIX, INDEX_SUFFIX):
+                self.fm.remove(job_id + suffix)
+
+    def open(self, job_id):
+        """ Start the log of a job, a previous log with its id is lost """
+        self._remove_old()
+        job_log = JobLog(self.fm, job_id, self.chunk_size, self.ring_lines)
+        self.running[job_id] = job_log
+        return job_log
+
+    def close(self, job_id):
+        self.running.pop(job_id).close()
+
+    def chunks(self, job_id):
+        """ Index of the job log, (offset, length, first_line, lines) """
+        self._check_job_id(job_id)
+        with self.fm.get_file(job_id + INDEX_SUFFIX) as fhandle:
+            data = fhandle.read()
+        # a chunk being written when the process died is ignored
+        data = data[:len(data) - len(data) % CHUNK.size]
+        return list(CHUNK.iter_unpack(data))
+
+    def read_chunk(self, job_id, chunk):
+        offset, length, _, _ = chunk
+        data = self.fm.read_range(job_id + LOG_SUFFIX, offset, length)
+        decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+        return decompressor.decompress(data).splitlines(keepends=True)
+
+    def tail(self, job_id, count):
+        """ Last count lines of a job
+
+        Only the chunks holding those lines are decompressed.
+        """
+        job_log = self.running.get(job_id)
+        if job_log is not None:
+            records = job_log.last_lines(count)
+            if records is not None:
+                return [_decode(record) for record in records]
+            job_log.flush()
+        result = []
+        for chunk in reversed(self.chunks(job_id)):
+            result[:0] = self.read_chunk(job_id, chunk)
+            if len(result) >= count:
+                break
+        return [_decode(record) for record in result[-count:]]
+
+    def grep(self, job_id, pattern, max_results=50, seconds=None):
+        """ Lines of a job matching a regular expression
+
+        Chunks are decompressed one by one, so memory stays bounded.
+
+        Args:
+            seconds: time budget, checked between lines
+        Raises:
+            GrepTimeout if the budget is exhausted
+        Returns:
+            list of (line number, line), starting from 1
+        """
+        regex = re.compile(pattern)
+        deadline = time.monotonic() + seconds if seconds else None
+        job_log = self.running.get(job_id)
+        if job_log is not None:
+            job_log.flush()
+        result = []
+        for chunk in self.chunks(job_id):
+            for number, record in enumerate(self.read_chunk(job_id, chunk),
+                                            chunk[2] + 1):
+                if deadline and time.monotonic() > deadline:
+                    raise GrepTimeout(result)
+                line = _decode(record)
+                if regex.search(line):
+                    result.append((number, line))
+                    if len(result) >= max_results:
+                        return result
+        return result
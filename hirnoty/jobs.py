@@ -3,9 +3,23 @@ import asyncio
 import logging
 import subprocess
 import threading
+import time
 from os import X_OK, access, path
 
+from hirnoty.joblog import STDERR, STDOUT
+from hirnoty.metrics import registry
+
 log = logging.getLogger(__name__)
+_started = registry.counter("hirnoty_jobs_started_total",
+                            "Subprocesses spawned by the job runner")
+_failed = registry.counter("hirnoty_jobs_failed_total",
+                           "Subprocesses finished with a non zero rc")
+_running = registry.gauge("hirnoty_jobs_running",
+                          "Subprocesses currently running")
+_duration = registry.histogram("hirnoty_job_seconds",
+                               "Wall clock time of subprocesses",
+                               buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0,
+                                        60.0, 300.0, 1800.0))
 
 
 class ScriptNotFound(Exception):
@@ -13,9 +27,21 @@ class ScriptNotFound(Exception):
 
 
 class Runner(object):
+    # lines read from stdout and stderr waiting to be handled
+    OUTPUT_QUEUE_SIZE = 100
+
+    def __init__(self, script_dir, template, args, job_logs=None):
+        """ Initialise runner
 
-    def __init__(self, script_dir, template, args):
+        Args:
+            script_dir: directory with the scripts
+            template: name of the script
+            args: argument or list of arguments of the script
+            job_logs: JobLogStore where the output is archived, the job id
+                is the pid of the process
+        """
         self.script_dir = script_dir
+        self.job_logs = job_logs
         self.template = template
         self.process = None
         self.command = self._get_script_path(self.template)
@@ -42,25 +68,71 @@ class Runner(object):
                         "0123456789-"
         return "".join([char for char in template if char in ALLOWED_CHARS])
 
+    async def _pump(self, stream, name, queue):
+        """ Queue the lines of a stream, then b"" or the error reading """
+        while True:
+            try:
+                data = await stream.readline()
+            except Exception as e:
+                # e.g. a line longer than the limit of the stream
+                await queue.put((name, e))
+                return
+            await queue.put((name, data))
+            if not data:
+                return
+
     async def work(self):
         if self._started:
             log.error("trying to rerun a job")
             return
+        start = time.perf_counter()
         self.process = await asyncio.create_subprocess_exec(
-            self.command, *self.args, stdout=asyncio.subprocess.PIPE)
+            self.command, *self.args, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        _started.inc()
+        _running.inc()
 
         pid = self.process.pid
+        job_id = str(pid)
+        job_log = self.job_logs.open(job_id) if self.job_logs else None
 
-        def format_output(text):
-            text = text.decode("utf-8")
+        def format_output(text, name):
+            text = text.decode("utf-8", "replace")
+            if name == STDERR:
+                return f"{pid} (stderr): {text}"
             return f"{pid}: {text}"
 
-        while True:
-            data = await self.process.stdout.readline()
-            if not data:
-                break
-            yield format_output(data)
+        # bounded, so a chatty process waits for us instead of filling
+        # the memory
+        queue = asyncio.Queue(self.OUTPUT_QUEUE_SIZE)
+        pumps = [asyncio.ensure_future(self._pump(self.process.stdout,
+                                                  STDOUT, queue)),
+                 asyncio.ensure_future(self._pump(self.process.stderr,
+                                                  STDERR, queue))]
+        try:
+            finished = 0
+            while finished < len(pumps):
+                name, data = await queue.get()
+                if isinstance(data, Exception):
+                    self.process.kill()
+                    await self.process.wait()
+                    raise data
+                if not data:
+                    finished += 1
+                    continue
+                if job_log:
+                    job_log.write(data, name)
+                yield format_output(data, name)
 
-        rc = await self.process.wait()
+            rc = await self.process.wait()
+        finally:
+            for pump in pumps:
+                pump.cancel()
+            if job_log:
+                self.job_logs.close(job_id)
+            _running.dec()
+            _duration.observe(time.perf_counter() - start)
+        if rc:
+            _failed.inc()
         yield f"{pid}: Finished with rc {rc}"
         self._started = True
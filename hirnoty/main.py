@@ -6,7 +6,10 @@ from hirnoty.bot import BotManager
 from hirnoty.bot_commands import Commands
 from hirnoty.jobs import Runner
 from hirnoty.logconfig import setup_logging
+from hirnoty.metrics import start_http_server
 from hirnoty.mq import MessageQueue
+from hirnoty.profiler import handle_profile
+from hirnoty.recorder import Recorder
 from hirnoty.settings import config
 
 log = logging.getLogger(__name__)
@@ -16,15 +19,32 @@ LOG_TOPIC = "log"
 
 def main():
     setup_logging(config["LOGLEVEL"], config["CONNECT_ADDRESS"], LOG_TOPIC)
-    bot_manager = BotManager(config["TOKEN"])
-    mq = MessageQueue(config["BIND_ADDRESS"])
+    recorder = Recorder(config["RECORD_PATH"]) \
+        if config["RECORD_PATH"] else None
+    bot_manager = BotManager(config["TOKEN"], config["API_SERVER"], recorder)
+    mq = MessageQueue(config["BIND_ADDRESS"], recorder)
     commands = Commands(config, bot_manager, mq)
 
     async def on_startup(dispatcher):
         asyncio.create_task(mq.receive_loop())
-
-    bot_manager.run(on_startup)
+        asyncio.create_task(commands.scheduler.run())
+        if config["METRICS_ADDRESS"]:
+            await start_http_server(config["METRICS_ADDRESS"],
+                                    routes={"/profile": handle_profile})
+        if config["MAINTENANCE_INTERVAL"]:
+            asyncio.create_task(
+                commands.maintainer.run(config["MAINTENANCE_INTERVAL"]))
+        if commands.prewarmer:
+            asyncio.create_task(commands.prewarmer.run())
+
+    async def on_shutdown(dispatcher):
+        # the index is closed after the uploads being indexed
+        await commands.shutdown()
+
+    bot_manager.run(on_startup, on_shutdown)
     commands.close()
+    if recorder:
+        recorder.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import logging
+import time
+import zlib
+
+from hirnoty.index import FILE_PRESENT
+from hirnoty.metrics import registry
+
+log = logging.getLogger(__name__)
+_reclaimed = registry.counter("hirnoty_maintenance_reclaimed_bytes_total",
+                              "Bytes freed removing orphan files")
+_orphans = registry.counter("hirnoty_maintenance_orphans_total",
+                            "Orphan files removed")
+_compacted = registry.counter("hirnoty_maintenance_compacted_lines_total",
+                              "Metadata lines removed by compaction")
+_verified = registry.counter("hirnoty_maintenance_verified_total",
+                             "Files whose checksum was verified")
+_corrupt = registry.counter("hirnoty_maintenance_corrupt_total",
+                            "Files failing verification")
+
+
+class IndexMaintainer(object):
+    """ Low priority background maintenance of an index
+
+    Compacts the metadata of the parts with many deleted entries, removes
+    files without an entry (deleted entries or crashes while adding) and
+    verifies the checksum of the files, a batch of them per run.
+
+    The work is done in time slices of at most slice_seconds followed by a
+    pause of pause_seconds, so the event loop is never blocked for long.
+
+    Args:
+        index: SimpleIndex or ShardedIndex
+        slice_seconds: maximum time working without yielding
+        pause_seconds: time yielded between slices
+        verify_batch: files verified per run
+        compact_ratio: dead/alive metadata lines ratio to compact
+        grace_seconds: files newer than this are never considered orphans,
+            as they might belong to an entry being added
+    """
+    def __init__(self, index, slice_seconds=0.01, pause_seconds=0.05,
+                 verify_batch=1000, compact_ratio=0.2, grace_seconds=600):
+        self.index = index
+        self.slice_seconds = slice_seconds
+        self.pause_seconds = pause_seconds
+        self.verify_batch = verify_batch
+        self.compact_ratio = compact_ratio
+        self.grace_seconds = grace_seconds
+        # verification continues where the last run stopped
+        self._verify_cursors = {}
+        self._slice_start = 0
+        self.last_report = None
+
+    async def _yield_if_needed(self):
+        if time.perf_counter() - self._slice_start > self.slice_seconds:
+            await asyncio.sleep(self.pause_seconds)
+            self._slice_start = time.perf_counter()
+
+
+    def _remove_file(self, part, entry_id):
+        with self.index.lock:
+            part.fm.remove(entry_id)
+
+    async def _compact(self, part, alive, report):
+        dead = part.dead_entries
+        if dead and dead > self.compact_ratio * max(alive, 1):
+            # rewriting a big metadata file takes a while, the loop must
+            # keep running
+            removed = await asyncio.get_running_loop().run_in_executor(
+                None, part.compact, self.index.lock)
+            log.info("Compacted %s, %d lines removed", part.meta_path,
+                     removed)
+            report["compacted_lines"] += removed
+            _compacted.inc(removed)
+
+    async def _collect_orphans(self, part, file_ids, entries, report):
+        alive = set(entry.entry_id for entry in entries)
+        deadline = time.time() - self.grace_seconds
+        for entry_id in file_ids:
+            await self._yield_if_needed()
+            if entry_id in alive:
+                continue
+            try:
+                info = part.fm.stat(entry_id)
+            except FileNotFoundError:
+                continue
+            # files written after the entries were listed (new or added
+            # again) are recent, so they are skipped here
+            if info.st_mtime > deadline:
+                continue
+            # the lock might be held by a compaction in other thread
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._remove_file, part, entry_id)
+            report["orphans"] += 1
+            report["reclaimed_bytes"] += info.st_size
+            _orphans.inc()
+            _reclaimed.inc(info.st_size)
+
+    @staticmethod
+    def _verify_entry(part, entry):
+        """ Return whether the file of the entry has the right content """
+        try:
+            content = zlib.decompress(part.fm.read_raw(entry.entry_id))
+        except (OSError, zlib.error):
+            return False
+        if entry.entry_type == FILE_PRESENT:
+            return hashlib.sha256(content).hexdigest() == entry.entry_id
+        return content == b""
+
+    async def _verify(self, part, entries, report):
+        if not entries:
+            return
+        cursor = self._verify_cursors.get(part.meta_path, 0)
+        if cursor >= len(entries):
+            cursor = 0
+        end = min(cursor + self.verify_batch, len(entries))
+        loop = asyncio.get_running_loop()
+        for entry in entries[cursor:end]:
+            await self._yield_if_needed()
+            # a single file can be big, it is hashed out of the loop
+            if await loop.run_in_executor(None, self._verify_entry, part,
+                                          entry):
+                report["verified"] += 1
+                _verified.inc()
+            else:
+                log.error("Verification failed for entry %s in %s",
+                          entry.entry_id, part.meta_dir)
+                report["corrupt"].append(entry.entry_id)
+                _corrupt.inc()
+        self._verify_cursors[part.meta_path] = end
+        report["verify_progress"].append((end, len(entries)))
+
+    async def run_once(self):
+        """ Run every maintenance task once
+
+        Returns:
+            report of the work done
+        """
+        report = {"compacted_lines": 0, "orphans": 0, "reclaimed_bytes": 0,
+                  "verified": 0, "corrupt": [], "verify_progress": [],
+                  "started": time.time()}
+        self._slice_start = time.perf_counter()
+        for part in self.index.parts():
+            # list files before getting the entries, so files of entries
+            # added in between are not listed
+            file_ids = part.fm.list_ids()
+            entries = list(part.entries())
+            await self._compact(part, len(entries), report)
+            await self._yield_if_needed()
+            await self._collect_orphans(part, file_ids, entries, report)
+            await self._verify(part, entries, report)
+        report["elapsed"] = time.time() - report["started"]
+        self.last_report = report
+        log.info("Index maintenance done: %s", self.format_report(report))
+        return report
+
+    async def run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                log.error("Error in index maintenance: %s", e)
+
+    @staticmethod
+    def format_report(report):
+        if report is None:
+            return "Maintenance has not run yet"
+        progress = ", ".join(f"{done}/{total}"
+                             for done, total in report["verify_progress"])
+        return (f"compacted {report['compacted_lines']} lines, "
+                f"removed {report['orphans']} orphan files "
+                f"({report['reclaimed_bytes']} bytes), "
+                f"verified {report['verified']} files "
+                f"(progress {progress or '-'}), "
+                f"{len(report['corrupt'])} corrupt, "
+                f"took {report['elapsed']:.1f}s")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import logging
+import time
+from bisect import bisect_left
+
+log = logging.getLogger(__name__)
+
+# latency buckets in seconds, the last implicit bucket is +Inf
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{_escape(_format_value(value))}"'
+                     for key, value in labels)
+    return "{" + inner + "}"
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter(object):
+    kind = COUNTER
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge(Counter):
+    kind = GAUGE
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(object):
+    kind = HISTOGRAM
+
+    def __init__(self, name, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # one extra slot for +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        acc = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            acc += count
+            yield (f"{self.name}_bucket", self.labels + (("le", bound),),
+                   acc)
+        yield f"{self.name}_sum", self.labels, self.sum
+        yield f"{self.name}_count", self.labels, self.count
+
+
+class _Timer(object):
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class Registry(object):
+    """ Keeps every metric of the process
+
+    Metrics are identified by name and labels, asking twice for the same
+    metric returns the same object, so callers are expected to keep a
+    reference to it instead of looking it up on every event.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._docs = {}
+
+    def _get(self, cls, name, doc, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = cls(name, key[1], **kwargs)
+            self._metrics[key] = metric
+            self._docs.setdefault(name, (cls.kind, doc))
+        elif type(metric) is not cls:
+            raise ValueError(f"Metric {name} already registered with "
+                             f"another type")
+        return metric
+
+    def counter(self, name, doc="", **labels):
+        return self._get(Counter, name, doc, labels)
+
+    def gauge(self, name, doc="", **labels):
+        return self._get(Gauge, name, doc, labels)
+
+    def histogram(self, name, doc="", buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, doc, labels, buckets=buckets)
+
+    def collect(self):
+        return sorted(self._metrics.values(),
+                      key=lambda metric: (metric.name, metric.labels))
+
+    def render(self):
+        """ Render all metrics using the prometheus text format """
+        lines = []
+        last_name = None
+        for metric in self.collect():
+            if metric.name != last_name:
+                kind, doc = self._docs[metric.name]
+                if doc:
+                    lines.append(f"# HELP {metric.name} {doc}")
+                lines.append(f"# TYPE {metric.name} {kind}")
+                last_name = metric.name
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} "
+                             f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """ Short human readable summary, suitable for a chat message """
+        lines = []
+        for metric in self.collect():
+            labels = ",".join(f"{key}={value}" for key, value in metric.labels)
+            name = f"{metric.name}[{labels}]" if labels else metric.name
+            if metric.kind == HISTOGRAM:
+                if not metric.count:
+                    continue
+                mean = metric.sum / metric.count * 1000
+                lines.append(f"{name}: n={metric.count} "
+                             f"mean={mean:.2f}ms")
+            else:
+                lines.append(f"{name}: {_format_value(metric.value)}")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+
+async def start_http_server(addr, registry=registry, routes=None):
+    """ Serve metrics in prometheus text format
+
+    Args:
+        addr: IP and port where to listen using format IP:PORT
+        registry: registry to expose
+        routes: dictionary of extra GET paths to aiohttp handlers
+    Returns:
+        aiohttp runner, call its cleanup method to stop the server
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(),
+                            content_type="text/plain",
+                            charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    for route, handler in (routes or {}).items():
+        app.router.add_get(route, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    host, port = addr.rsplit(":", 1)
+    site = web.TCPSite(runner, host, int(port))
+    await site.start()
+    log.info("Serving metrics in http://%s/metrics", addr)
+    return runner
@@ -3,19 +3,31 @@ import logging
 
 import zmq
 import zmq.asyncio
+from hirnoty.metrics import registry
+from hirnoty.recorder import MQ
 from hirnoty.settings import config
 
 log = logging.getLogger(__name__)
+_received = registry.counter("hirnoty_mq_received_total",
+                             "Messages received from the queue")
+_errors = registry.counter("hirnoty_mq_errors_total",
+                           "Errors while processing queue messages")
+_pending = registry.gauge("hirnoty_mq_pending",
+                          "Messages waiting in the socket after a receive")
+_notify_latency = registry.histogram("hirnoty_mq_notify_seconds",
+                                     "Time spent delivering a message to "
+                                     "subscribers")
 
 
 class MessageQueue(object):
 
-    def __init__(self, addr):
+    def __init__(self, addr, recorder=None):
         self.context = zmq.asyncio.Context()
         self.socket = self.context.socket(zmq.PULL)
         log.info("Binding in address: %s", addr)
         self.socket.bind(f"tcp://{addr}")
         self._subscribers = {}
+        self._recorder = recorder
 
     def subscribe(self, topic, callback):
         log.info("Added callback to topic: %s", topic)
@@ -36,9 +48,20 @@ class MessageQueue(object):
         while True:
             try:
                 topic, data = await self.socket.recv_multipart()
+                _received.inc()
+                _pending.set(self._pending())
                 log.debug("Receive %s from topic %s", data, topic)
                 topic = topic.decode("utf-8")
                 data = data.decode("utf-8")
-                await self.notify(topic, data)
+                if self._recorder:
+                    self._recorder.record(MQ, {"topic": topic, "data": data})
+                with _notify_latency.time():
+                    await self.notify(topic, data)
             except Exception as e:
+                _errors.inc()
                 log.error("Error in mq loop: %s", e)
+
+    def _pending(self):
+        # zmq doesn't expose the queue length, we can only know whether
+        # there is at least one more message ready to be read
+        return 1 if self.socket.get(zmq.EVENTS) & zmq.POLLIN else 0
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import time
+
+from aiogram.utils.exceptions import RetryAfter
+
+from hirnoty.index import FILE_PRESENT
+from hirnoty.metrics import registry
+
+log = logging.getLogger(__name__)
+_uploaded = registry.counter("hirnoty_prewarm_uploaded_total",
+                             "Files uploaded in advance to the storage chat")
+_uploaded_bytes = registry.counter("hirnoty_prewarm_uploaded_bytes_total",
+                                   "Bytes uploaded in advance")
+_failed = registry.counter("hirnoty_prewarm_failed_total",
+                           "Uploads in advance that failed")
+_pending = registry.gauge("hirnoty_prewarm_pending",
+                          "Files without a telegram file id")
+
+
+class Prewarmer(object):
+    """ Uploads in the background the files telegram doesn't know yet
+
+    Files are sent to a storage chat while the bot is idle and their file
+    ids recorded, so searching them later only forwards the file id instead
+    of uploading the whole file. Files found by recent searches go first.
+
+    Args:
+        index: index with the files
+        bot_manager: BotManager used to upload, its last_activity tells
+            when the bot is idle
+        file_id_cache: dictionary from entry id to telegram file id
+        chat_id: chat where the files are uploaded
+        bytes_per_second: average upload bandwidth allowed
+        min_interval: minimum seconds between uploads
+        idle_seconds: seconds without updates to consider the bot idle
+        decay: factor applied to the search scores on every pass, so old
+            searches weigh less
+    """
+    def __init__(self, index, bot_manager, file_id_cache, chat_id,
+                 bytes_per_second=1024 ** 2, min_interval=1.0,
+                 idle_seconds=5.0, decay=0.5):
+        self.index = index
+        self.bot_manager = bot_manager
+        self.file_id_cache = file_id_cache
+        self.chat_id = chat_id
+        self.bytes_per_second = bytes_per_second
+        self.min_interval = min_interval
+        self.idle_seconds = idle_seconds
+        self.decay = decay
+        self._scores = {}
+        # files failing to upload are not retried until restarted
+        self._failed = set()
+
+    def is_cold(self, entry):
+        return entry.entry_type == FILE_PRESENT and not entry.extra and \
+            entry.entry_id not in self.file_id_cache and \
+            entry.entry_id not in self._failed
+
+    def record_search(self, entries):
+        for entry in entries:
+            if self.is_cold(entry):
+                self._scores[entry.entry_id] = \
+                    self._scores.get(entry.entry_id, 0) + 1
+
+    def is_idle(self):
+        return time.monotonic() - self.bot_manager.last_activity >= \
+            self.idle_seconds
+
+    def pending(self):
+        """ Cold entries, the most searched first """
+        entries = [entry for entry in self.index.entries()
+                   if self.is_cold(entry)]
+        entries.sort(key=lambda entry: self._scores.get(entry.entry_id, 0),
+                     reverse=True)
+        return entries
+
+    def _decay_scores(self):
+        self._scores = {entry_id: score * self.decay
+                        for entry_id, score in self._scores.items()
+                        if score * self.decay >= 0.01}
+
+    async def upload(self, entry):
+        """ Upload the file of an entry
+
+        Returns:
+            bytes uploaded, 0 if it failed
+        """
+        loop = asyncio.get_running_loop()
+        # decompressing can take a while for big files
+        fhandle = await loop.run_in_executor(None, self.index.get_file,
+                                             entry.entry_id)
+        size = len(fhandle.getbuffer())
+        try:
+            sent = await self.bot_manager.bot.send_document(
+                self.chat_id, (entry.filename, fhandle),
+                disable_notification=True)
+        except RetryAfter:
+            raise
+        except Exception as e:
+            log.error("Error uploading %s in advance: %s", entry.entry_id, e)
+            self._failed.add(entry.entry_id)
+            _failed.inc()
+            return 0
+        # it might have been uploaded by a search meanwhile, keep that one
+        self.file_id_cache.setdefault(entry.entry_id, sent.document.file_id)
+        self._scores.pop(entry.entry_id, None)
+        _uploaded.inc()
+        _uploaded_bytes.inc(size)
+        log.info("Uploaded %s in advance (%d bytes)", entry.entry_id, size)
+        return size
+
+    async def run_once(self):
+        """ Upload cold files until the bot is busy or none is left
+
+        Returns:
+            number of files uploaded
+        """
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(None, self.pending)
+        self._decay_scores()
+        _pending.set(len(entries))
+        uploaded = 0
+        for entry in entries:
+            if not self.is_idle():
+                break
+            if not self.is_cold(entry):
+                continue
+            try:
+                size = await self.upload(entry)
+            except RetryAfter as e:
+                log.info("Rate limited, pausing uploads for %d s", e.timeout)
+                await asyncio.sleep(e.timeout)
+                continue
+            if size:
+                uploaded += 1
+                _pending.dec()
+            await asyncio.sleep(max(self.min_interval,
+                                    size / self.bytes_per_second))
+        return uploaded
+
+    async def run(self, interval=60):
+        while True:
+            if self.is_idle():
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    log.error("Error uploading files in advance: %s", e)
+                await asyncio.sleep(interval)
+            else:
+                await asyncio.sleep(self.idle_seconds)
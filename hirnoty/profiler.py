@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import signal
+import sys
+import threading
+import time
+from collections import Counter as TallyCounter
+from os import path
+
+from hirnoty.metrics import HISTOGRAM, registry
+
+log = logging.getLogger(__name__)
+
+# maximum length of a profile requested remotely
+MAX_SECONDS = 300
+
+
+class ProfileInProgress(Exception):
+    pass
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler(object):
+    """ Samples the stacks of every thread on SIGPROF
+
+    The timer counts CPU time of the process, so waiting for I/O is not
+    sampled, slow callbacks cover that. It must be started and stopped from
+    the main thread, as signal handlers can only be installed there.
+
+    Args:
+        interval: seconds of CPU time between samples
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        # collapsed stack (root first, separated by ;) -> samples
+        self.stacks = TallyCounter()
+        self.samples = 0
+        self._previous_handler = None
+
+    def _handle(self, signum, frame):
+        self.samples += 1
+        names = {thread.ident: thread.name
+                 for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        # the frame interrupted, not the one of this handler
+        frames[threading.get_ident()] = frame
+        for thread_id, thread_frame in frames.items():
+            stack = []
+            while thread_frame is not None:
+                stack.append(_frame_name(thread_frame))
+                thread_frame = thread_frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._previous_handler = signal.signal(signal.SIGPROF, self._handle)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or
+                      signal.SIG_DFL)
+
+    def collapsed(self):
+        """ Stacks in the format used by flamegraph.pl and speedscope """
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in sorted(self.stacks.items()))
+
+    def top_functions(self, count):
+        """ Functions where most samples were taken (self time) """
+        leaves = TallyCounter()
+        for stack, samples in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += samples
+        return leaves.most_common(count)
+
+
+class SlowCallbackHandler(logging.Handler):
+    """ Keeps the slow callbacks reported by asyncio in debug mode """
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+
+    def emit(self, record):
+        if isinstance(record.msg, str) and \
+                record.msg.startswith("Executing ") and \
+                isinstance(record.args, tuple) and len(record.args) == 2:
+            handle, seconds = record.args
+            self.callbacks.append((seconds, str(handle)))
+
+
+def _histograms():
+    return {metric: (metric.count, metric.sum)
+            for metric in registry.collect() if metric.kind == HISTOGRAM}
+
+
+class Profile(object):
+    """ Result of a profiling window """
+    def __init__(self, seconds, sampler, slow_callbacks, timings):
+        self.seconds = seconds
+        self.sampler = sampler
+        self.slow_callbacks = sorted(slow_callbacks, reverse=True)
+        # (total seconds, count, metric name)
+        self.timings = timings
+
+    def collapsed(self):
+        return self.sampler.collapsed()
+
+    def report(self, top=10):
+        lines = [f"Profile of {self.seconds:.1f}s, "
+                 f"{self.sampler.samples} samples, "
+                 f"{len(self.slow_callbacks)} slow callbacks", "",
+                 "Slowest operations (from metrics):"]
+        for total, count, name in self.timings[:top]:
+            lines.append(f"  {name}: n={count} total={total * 1000:.1f}ms "
+                         f"mean={total / count * 1000:.2f}ms")
+        lines += ["", "Slow callbacks blocking the loop:"]
+        for seconds, handle in self.slow_callbacks[:top]:
+            lines.append(f"  {seconds * 1000:.1f}ms {handle}")
+        lines += ["", "Functions using most CPU:"]
+        total = max(self.sampler.samples, 1)
+        for name, samples in self.sampler.top_functions(top):
+            lines.append(f"  {samples * 100 / total:5.1f}% {name}")
+        return "\n".join(lines) + "\n"
+
+
+_running = False
+
+
+async def profile(seconds, interval=0.005, slow_callback_duration=0.05):
+    """ Profile the running process for some seconds
+
+    Enables the stack sampler and the asyncio debug mode, which reports
+    callbacks running longer than slow_callback_duration.
+
+    Raises:
+        ProfileInProgress if other profile is running
+    Returns:
+        Profile
+    """
+    global _running
+    if _running:
+        raise ProfileInProgress("A profile is already running")
+    _running = True
+    try:
+        loop = asyncio.get_running_loop()
+        handler = SlowCallbackHandler()
+        asyncio_log = logging.getLogger("asyncio")
+        debug = loop.get_debug()
+        previous_duration = loop.slow_callback_duration
+        sampler = StackSampler(interval)
+        before = _histograms()
+        start = time.perf_counter()
+        asyncio_log.addHandler(handler)
+        loop.slow_callback_duration = slow_callback_duration
+        loop.set_debug(True)
+        sampler.start()
+        log.info("Profiling for %.1f s", seconds)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+            loop.set_debug(debug)
+            loop.slow_callback_duration = previous_duration
+            asyncio_log.removeHandler(handler)
+        timings = []
+        for metric, (count, total) in _histograms().items():
+            old_count, old_total = before.get(metric, (0, 0.0))
+            if count > old_count:
+                labels = ",".join(f"{key}={value}"
+                                  for key, value in metric.labels)
+                name = f"{metric.name}[{labels}]" if labels else metric.name
+                timings.append((total - old_total, count - old_count, name))
+        timings.sort(reverse=True)
+        return Profile(time.perf_counter() - start, sampler,
+                       handler.callbacks, timings)
+    finally:
+        _running = False
+
+
+async def handle_profile(request):
+    """ aiohttp handler of /profile?seconds=N, the result is JSON """
+    from aiohttp import web
+
+    try:
+        seconds = float(request.query.get("seconds", 10))
+    except ValueError:
+        seconds = -1
+    if not 0 < seconds <= MAX_SECONDS:
+        raise web.HTTPBadRequest(
+            text=f"seconds must be between 0 and {MAX_SECONDS}")
+    try:
+        result = await profile(seconds)
+    except ProfileInProgress as e:
+        raise web.HTTPConflict(text=str(e))
+    return web.json_response({"report": result.report(),
+                              "collapsed": result.collapsed()})
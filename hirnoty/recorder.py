@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+import json
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+UPDATE = "update"
+MQ = "mq"
+
+
+class Recorder(object):
+    """ Records incoming traffic to a JSON lines file
+
+    Each line has the format {"t": timestamp, "kind": kind, "data": data},
+    where kind is UPDATE for telegram updates and MQ for queue messages.
+    The file can be replayed with benchmarks/replay.py
+    """
+    def __init__(self, path):
+        log.info("Recording traffic to %s", path)
+        self._fhandle = open(path, "a")
+
+    def record(self, kind, data):
+        self._fhandle.write(json.dumps({"t": time.time(), "kind": kind,
+                                        "data": data}) + "\n")
+        self._fhandle.flush()
+
+    def close(self):
+        self._fhandle.close()
+
+
+def load_records(path):
+    with open(path, "r") as fhandle:
+        for line in fhandle:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+from hirnoty.jobs import Runner
+from hirnoty.metrics import registry
+
+log = logging.getLogger(__name__)
+_schedules = registry.gauge("hirnoty_schedules", "Schedules configured")
+_fired = registry.counter("hirnoty_schedules_fired_total",
+                          "Scheduled jobs started")
+_skipped = registry.counter("hirnoty_schedules_skipped_total",
+                            "Scheduled runs skipped, the job was running")
+_lag = registry.histogram("hirnoty_scheduler_lag_seconds",
+                          "Delay between the scheduled and the real start")
+
+# name: (minimum, maximum)
+CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31),
+               ("month", 1, 12), ("weekday", 0, 7))
+CRON_ALIASES = {"@hourly": "0 * * * *",
+                "@daily": "0 0 * * *",
+                "@weekly": "0 0 * * 0",
+                "@monthly": "0 0 1 * *",
+                "@yearly": "0 0 1 1 *"}
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+EVERY_RE = re.compile(r"@every\s+(\d+)([smhd])$")
+
+
+class CronSpec(object):
+    """ Cron expression with the usual 5 fields in local time
+
+    Fields accept *, numbers, ranges (a-b), steps (*/n, a-b/n) and lists
+    separated by commas. As in cron, if both day and weekday are
+    restricted a day matching any of them is enough.
+    """
+    def __init__(self, text):
+        fields = CRON_ALIASES.get(text, text).split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"Expected {len(CRON_FIELDS)} fields: {text}")
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [self._parse_field(field, low, high)
+                           for field, (_, low, high)
+                           in zip(fields, CRON_FIELDS)]
+        # 0 and 7 are sunday
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(text, low, high):
+        values = set()
+        for part in text.split(","):
+            interval, _, step = part.partition("/")
+            step = int(step) if step else 1
+            if interval == "*":
+                start, end = low, high
+            elif "-" in interval:
+                start, end = [int(item) for item in interval.split("-", 1)]
+            else:
+                start = int(interval)
+                end = high if step != 1 else start
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"Invalid field: {text}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        # python starts the week on monday, cron on sunday
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, timestamp):
+        """ First matching time after timestamp """
+        moment = datetime.fromtimestamp(timestamp).replace(
+            second=0, microsecond=0) + timedelta(minutes=1)
+        # 29th of february on a given weekday might take years
+        limit = moment + timedelta(days=366 * 28)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) +
+                          timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError("The expression never matches")
+
+
+class IntervalSpec(object):
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("The interval must be positive")
+        self.seconds = seconds
+
+    def next_after(self, timestamp):
+        return timestamp + self.seconds
+
+
+def parse_spec(text):
+    """ Parse "@every <n>(s|m|h|d)", a cron alias or a cron expression """
+    text = text.strip()
+    match = EVERY_RE.match(text)
+    if match:
+        return IntervalSpec(int(match.group(1)) * UNITS[match.group(2)])
+    return CronSpec(text)
+
+
+class Schedule(object):
+    """ Script run periodically, its output is sent to a topic
+
+    Args:
+        name: identifier of the schedule
+        spec: text accepted by parse_spec
+        script: script name in the script directory
+        args: arguments of the script
+        topic: topic receiving the output, defaults to the name
+        jitter: maximum random seconds added to each run, to spread runs
+            scheduled at the same time
+        skip_if_running: skip a run if the previous one didn't finish
+    """
+    def __init__(self, name, spec, script, args=(), topic=None, jitter=0,
+                 skip_if_running=True):
+        self.name = name
+        self.spec_text = spec
+        self.spec = parse_spec(spec)
+        if jitter < 0:
+            raise ValueError("The jitter can't be negative")
+        self.script = script
+        self.args = list(args)
+        self.topic = topic or name
+        self.jitter = jitter
+        self.skip_if_running = skip_if_running
+        # time of the next run without jitter, so jitter doesn't accumulate
+        self.next_time = None
+        self.next_run = None
+
+    def to_dict(self):
+        return {"name": self.name, "spec": self.spec_text,
+                "script": self.script, "args": self.args,
+                "topic": self.topic, "jitter": self.jitter,
+                "skip_if_running": self.skip_if_running}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class TimingWheel(object):
+    """ Hierarchical timing wheel
+
+    Items are added with the tick they expire in. Each level has 2**bits
+    slots, a slot of a level spans a whole turn of the level below and is
+    moved down a level when reached. Adding and advancing a tick are O(1)
+    (amortised), no matter how many items there are. Items further than the
+    range of all the levels wait in an overflow list.
+    """
+    def __init__(self, levels=4, bits=6):
+        self.levels = levels
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.wheels = [[[] for _ in range(1 << bits)]
+                       for _ in range(levels)]
+        self.overflow = []
+        self.current = 0
+
+    def add(self, tick, item):
+        """ Add an item, ticks already passed expire in the next one """
+        self._place(max(tick, self.current + 1), item)
+
+    def _place(self, tick, item):
+        delta = tick - self.current
+        for level in range(self.levels):
+            if delta < 1 << (self.bits * (level + 1)):
+                slot = (tick >> (self.bits * level)) & self.mask
+                self.wheels[level][slot].append((tick, item))
+                return
+        self.overflow.append((tick, item))
+
+    def _cascade(self, level):
+        slot = (self.current >> (self.bits * level)) & self.mask
+        items = self.wheels[level][slot]
+        self.wheels[level][slot] = []
+        for tick, item in items:
+            # items of the current tick go to the slot processed next
+            self._place(tick, item)
+
+    def advance(self):
+        """ Move to the next tick
+
+        Returns:
+            items expiring in the new tick
+        """
+        self.current += 1
+        for level in range(1, self.levels):
+            if self.current & ((1 << (self.bits * level)) - 1):
+                break
+            self._cascade(level)
+            if level == self.levels - 1:
+                overflow = self.overflow
+                self.overflow = []
+                for tick, item in overflow:
+                    self._place(tick, item)
+        slot = self.current & self.mask
+        due = self.wheels[0][slot]
+        self.wheels[0][slot] = []
+        return [item for _, item in due]
+
+
+class Scheduler(object):
+    """ Runs scripts on schedules, publishing their output to topics
+
+    Args:
+        script_dir: directory with the scripts
+        mq: MessageQueue the output is published to
+        path: JSON file where the schedules are persisted, None to not
+            persist them
+        tick: resolution in seconds
+        clock: function returning the current time
+        job_logs: JobLogStore where the output of the jobs is archived
+    """
+    def __init__(self, script_dir, mq, path=None, tick=1.0, clock=time.time,
+                 job_logs=None):
+        self.script_dir = script_dir
+        self.job_logs = job_logs
+        self.mq = mq
+        self.path = path
+        self.tick = tick
+        self.clock = clock
+        self.schedules = {}
+        self.wheel = TimingWheel()
+        self._origin = clock()
+        # tasks of the jobs running by schedule name
+        self._running = {}
+        self._rng = random.Random()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as fhandle:
+            items = json.load(fhandle)
+        for data in items:
+            try:
+                self.add(Schedule.from_dict(data), save=False)
+            except ValueError as e:
+                log.error("Ignoring schedule %s: %s", data.get("name"), e)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as fhandle:
+            json.dump([schedule.to_dict()
+                       for schedule in self.schedules.values()], fhandle,
+                      indent=1)
+            fhandle.flush()
+            os.fsync(fhandle.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _to_tick(self, timestamp):
+        return math.ceil((timestamp - self._origin) / self.tick)
+
+    def _arm(self, schedule, after):
+        schedule.next_time = schedule.spec.next_after(after)
+        schedule.next_run = schedule.next_time + \
+            self._rng.uniform(0, schedule.jitter)
+        # the schedule object identifies this timer, replacing or removing
+        # the schedule makes it stale
+        self.wheel.add(self._to_tick(schedule.next_run), schedule)
+
+    def add(self, schedule, save=True):
+        """ Add or replace a schedule
+
+        Raises:
+            ScriptNotFound if the script doesn't exist
+        """
+        Runner(self.script_dir, schedule.script, schedule.args)
+        self.schedules[schedule.name] = schedule
+        self._arm(schedule, self.clock())
+        _schedules.set(len(self.schedules))
+        if save:
+            self._save()
+        log.info("Schedule %s added: %s", schedule.name, schedule.spec_text)
+
+    def remove(self, name):
+        """ Remove a schedule, a running job is not stopped
+
+        Raises:
+            KeyError if there is no schedule with that name
+        """
+        del self.schedules[name]
+        _schedules.set(len(self.schedules))
+        self._save()
+        log.info("Schedule %s removed", name)
+
+    def is_running(self, name):
+        return bool(self._running.get(name))
+
+    def running_tasks(self):
+        return [task for tasks in self._running.values() for task in tasks]
+
+    def _fire(self, schedule, now):
+        scheduled = schedule.next_run
+        # the next run is computed from the scheduled time to not drift,
+        # unless it is late (e.g. suspended), then missed runs are skipped
+        if now - scheduled > self.tick:
+            self._arm(schedule, now)
+        else:
+            self._arm(schedule, schedule.next_time)
+        if schedule.skip_if_running and self.is_running(schedule.name):
+            log.warning("Skipping %s, the previous run didn't finish",
+                        schedule.name)
+            _skipped.inc()
+            return
+        _fired.inc()
+        _lag.observe(max(0.0, now - scheduled))
+        task = asyncio.ensure_future(self._run_job(schedule))
+        tasks = self._running.setdefault(schedule.name, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _run_job(self, schedule):
+        log.info("Running scheduled job %s", schedule.name)
+        try:
+            runner = Runner(self.script_dir, schedule.script, schedule.args,
+                            self.job_logs)
+            async for line in runner.work():
+                await self.mq.notify(schedule.topic, line.rstrip("\n"))
+        except Exception as e:
+            log.error("Error in scheduled job %s: %s", schedule.name, e)
+
+    def run_pending(self):
+        """ Process the ticks up to now
+
+        Returns:
+            schedules started or skipped
+        """
+        now = self.clock()
+        due = []
+        while self._origin + (self.wheel.current + 1) * self.tick <= now:
+            for schedule in self.wheel.advance():
+                # removed or replaced
+                if self.schedules.get(schedule.name) is not schedule:
+                    continue
+                self._fire(schedule, now)
+                due.append(schedule)
+        return due
+
+    async def run(self):
+        while True:
+            self.run_pending()
+            next_tick = self._origin + (self.wheel.current + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick - self.clock()))
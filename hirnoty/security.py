@@ -1,57 +1,174 @@
-import asyncio
+import functools
+import hashlib
+import heapq
 import logging
+import os
+import time
 
+from hirnoty.metrics import registry
 from hirnoty.settings import config
 
 log = logging.getLogger(__name__)
 
+BAN_SECONDS = 30
 
-def check_otp(message):
+
+class OTPStore(object):
+    """ One time passwords, consumed from the end of the file to the start
+
+    The OTP file is read once, consumed passwords are recorded appending
+    to a log next to it (OTP path + ".used") instead of rewriting the OTP
+    file. The first line of the log identifies the OTP file it belongs to,
+    so replacing the OTP file starts a new log.
+    """
+    def __init__(self, otp_path):
+        self.path = otp_path
+        self.log_path = otp_path + ".used"
+        with open(otp_path, "r") as fhandle:
+            content = fhandle.read()
+        self._passwords = [line for line in content.split("\n") if line]
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        consumed = self._load_log(digest)
+        self._next = len(self._passwords) - 1 - consumed
+        self._log_fd = os.open(self.log_path,
+                               os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def _load_log(self, digest):
+        try:
+            with open(self.log_path, "r") as fhandle:
+                lines = fhandle.read().split("\n")
+        except FileNotFoundError:
+            lines = []
+        if lines and lines[0] == digest:
+            return len([line for line in lines[1:] if line])
+        # new OTP file, replace the log atomically
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "w") as fhandle:
+            fhandle.write(f"{digest}\n")
+        os.replace(tmp_path, self.log_path)
+        return 0
+
+    @property
+    def remaining(self):
+        return self._next + 1
+
+    def consume(self, text):
+        """ Consume the current password if text ends with it
+
+        Returns:
+            the password consumed or None
+        """
+        if self._next < 0:
+            return None
+        password = self._passwords[self._next]
+        if not text.endswith(password):
+            return None
+        # a single small write with O_APPEND is atomic, no fsync as it
+        # would cost milliseconds per message, the page cache survives a
+        # crash of the process
+        os.write(self._log_fd, f"{self._next}\n".encode())
+        self._next -= 1
+        return password
+
+    def close(self):
+        os.close(self._log_fd)
+
+
+class BanList(object):
+    """ Users banned until a deadline
+
+    Deadlines are kept in a heap, expired bans are dropped when checking,
+    so no task has to wait for them.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._deadlines = {}
+        self._heap = []
+
+    def ban(self, user_id, seconds):
+        deadline = self._clock() + seconds
+        self._deadlines[user_id] = deadline
+        heapq.heappush(self._heap, (deadline, user_id))
+
+    def _expire(self):
+        now = self._clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, user_id = heapq.heappop(self._heap)
+            # only if it wasn't banned again later
+            if self._deadlines.get(user_id) == deadline:
+                del self._deadlines[user_id]
+
+    def is_banned(self, user_id):
+        if not self._deadlines:
+            return False
+        self._expire()
+        return user_id in self._deadlines
+
+    def __len__(self):
+        self._expire()
+        return len(self._deadlines)
+
+
+bans = BanList()
+_otp_store = None
+
+
+def get_otp_store():
+    global _otp_store
     OTP = config["OTP"]
-    text = message["text"]
     if OTP is None:
-        return True
+        return None
+    if _otp_store is None or _otp_store.path != OTP:
+        if _otp_store is not None:
+            _otp_store.close()
+        log.info("Loading one time passwords from %s", OTP)
+        _otp_store = OTPStore(OTP)
+    return _otp_store
 
-    with open(OTP, "r") as fhandler:
-        data = fhandler.read().split("\n")
 
-    if not data:
-        return False
-
-    if text.endswith(data[-1]):
-        with open(OTP, "w") as fhandler:
-            fhandler.write("\n".join(data[:-1]))
-        message["text"] = text[:-len(data[-1])]
+def check_otp(message):
+    store = get_otp_store()
+    if store is None:
         return True
 
-    return False
+    text = message["text"]
+    password = store.consume(text)
+    if password is None:
+        return False
+    message["text"] = text[:-len(password)]
+    return True
 
 
 def check_acl(user_id):
+    if bans.is_banned(user_id):
+        return False
     return config['ACL'] is None or user_id in config['ACL']
 
 
-async def temporal_ban(user_id):
-    ACL = config["ACL"]
-    if ACL is None:
-        return
+def temporal_ban(user_id, seconds=BAN_SECONDS):
     log.info('Temporary banning %d', user_id)
-    ACL.remove(user_id)
-    await asyncio.sleep(30)
-    ACL.add(user_id)
+    bans.ban(user_id, seconds)
 
 
 def run_handler_if_allowed(func):
-    OTP = config["OTP"]
+    acl_denied = registry.counter("hirnoty_denied_total",
+                                  "Messages rejected by security checks",
+                                  check="acl")
+    otp_denied = registry.counter("hirnoty_denied_total",
+                                  "Messages rejected by security checks",
+                                  check="otp")
 
+    @functools.wraps(func)
     async def new_func(message):
         user_id = message['from']['id']
         if not check_acl(user_id):
+            acl_denied.inc()
             log.info(f'ACL: Unallowed access attempted: {str(message)}')
             return
         if not check_otp(message):
+            otp_denied.inc()
             log.info(f'OTP: Unallowed access attempted: {str(message)}')
-            await temporal_ban(user_id)
+            temporal_ban(user_id)
             return
         await func(message)
     return new_func
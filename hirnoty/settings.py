@@ -10,7 +10,18 @@ _ALLOWED = set(["ACL",
                 "OTP",
                 "SCRIPT_DIR",
                 "INDEX_DIR",
-                "INVERTED_INDEX"]).union(_REQUIRED)
+                "INVERTED_INDEX",
+                "SEARCH_CACHE_SIZE",
+                "INDEX_SHARDS",
+                "MAINTENANCE_INTERVAL",
+                "STORAGE_CHAT",
+                "PREWARM_BANDWIDTH",
+                "INGEST_WORKERS",
+                "INGEST_QUEUE_SIZE",
+                "JOB_LOG_DIR",
+                "METRICS_ADDRESS",
+                "RECORD_PATH",
+                "API_SERVER"]).union(_REQUIRED)
 SYS_CONFIG_DIR = path.join('/etc', 'hirnoty')
 SYS_CONFIG_PATH = path.join(SYS_CONFIG_DIR, "config.py")
 CONFIG_DIR = path.join(path.expanduser('~'), '.config', 'hirnoty')
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import logging
+import threading
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from hirnoty.index import SimpleIndex, make_entry
+from hirnoty.metrics import registry
+
+log = logging.getLogger(__name__)
+_moved = registry.counter("hirnoty_index_rebalanced_total",
+                          "Entries moved between shards")
+_shards = registry.gauge("hirnoty_index_shards", "Number of index shards")
+
+SHARD_ID_FILENAME = ".shard_id"
+# entries are routed by the first two hex digits of their id
+BUCKETS = 256
+
+
+def _load_shard_id(meta_dir):
+    """ Return the id of the shard in meta_dir, creating it if needed
+
+    The id is stored in the shard directory, so the routing doesn't change
+    if the directory is mounted somewhere else.
+    """
+    id_path = path.join(meta_dir, SHARD_ID_FILENAME)
+    if path.exists(id_path):
+        with open(id_path, 'r') as fhandle:
+            return fhandle.read().strip()
+    shard_id = uuid.uuid4().hex
+    with open(id_path, 'w') as fhandle:
+        fhandle.write(shard_id)
+    return shard_id
+
+
+def _bucket(entry_id):
+    return int(entry_id[:2], 16)
+
+
+def _weight(shard_id, bucket):
+    return hashlib.sha256(f"{shard_id}:{bucket}".encode()).digest()
+
+
+class ShardedIndex(SimpleIndex):
+    """ Index split in shards, each one with its own directory
+
+    Entries are routed by the prefix of their id using rendezvous hashing,
+    so adding a shard only moves the entries of the buckets it takes over.
+    Searches are sent to all the shards in parallel and merged.
+    """
+    def __init__(self, meta_dirs, use_inverted_index=False, cache_size=128,
+                 workers=None):
+        self.use_inverted_index = use_inverted_index
+        self.shards = []
+        self._shard_ids = []
+        self._routing = []
+        # serialises changes, searches don't need it
+        self.lock = threading.RLock()
+        self._rebalancing = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or len(meta_dirs) + 1,
+            thread_name_prefix="index")
+        self._init_cache(cache_size)
+        for meta_dir in meta_dirs:
+            self._open_shard(meta_dir)
+        self._update_routing()
+        # entries out of place (e.g. a shard was added to the
+        # configuration) are moved in the background
+        self.rebalance_future = self._executor.submit(self.rebalance)
+
+    def _open_shard(self, meta_dir):
+        log.info("Opening index shard %s", meta_dir)
+        shard = SimpleIndex(meta_dir, None, self.use_inverted_index, 0)
+        self.shards.append(shard)
+        self._shard_ids.append(_load_shard_id(meta_dir))
+        _shards.set(len(self.shards))
+
+    def _update_routing(self):
+        self._routing = [
+            max(range(len(self.shards)),
+                key=lambda i: _weight(self._shard_ids[i], bucket))
+            for bucket in range(BUCKETS)]
+
+    def shard_for(self, entry_id):
+        return self.shards[self._routing[_bucket(entry_id)]]
+
+    def close(self):
+        log.info("Closing sharded index")
+        self._executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+    def get_file(self, entry_id):
+        self._verify_entry_id(entry_id)
+        owner = self.shard_for(entry_id)
+        if owner.contains(entry_id):
+            return owner.get_file(entry_id)
+        # it might not have been moved yet
+        for shard in self.shards:
+            if shard.contains(entry_id):
+                return shard.get_file(entry_id)
+        raise FileNotFoundError(f"Entry {entry_id} not found")
+
+    def contains(self, entry_id):
+        return any(shard.contains(entry_id) for shard in self.shards)
+
+    def parts(self):
+        return list(self.shards)
+
+    def delete_entry(self, entry_id):
+        self._verify_entry_id(entry_id)
+        with self.lock:
+            # while rebalancing it can be in two shards
+            shards = [shard for shard in self.shards
+                      if shard.contains(entry_id)]
+            if not shards:
+                raise KeyError(f"Entry {entry_id} not found")
+            for shard in shards:
+                shard.delete_entry(entry_id)
+        self.generation += 1
+
+    def entries(self):
+        seen = set()
+        for shard in self.shards:
+            for entry in shard.entries():
+                if entry.entry_id not in seen:
+                    seen.add(entry.entry_id)
+                    yield entry
+
+    def _search(self, text):
+        # the text is already normalised and the latency measured, so the
+        # shards are searched skipping both
+        if len(self.shards) == 1:
+            return self.shards[0]._search(text)
+        futures = [self._executor.submit(shard._search, text)
+                   for shard in self.shards]
+        return self._merge([future.result() for future in futures])
+
+    async def _asearch(self, text):
+        if len(self.shards) == 1:
+            return self.shards[0]._search(text)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, shard._search, text)
+            for shard in self.shards])
+        return self._merge(results)
+
+    @staticmethod
+    def _merge(results):
+        result = []
+        seen = set()
+        for shard_result in results:
+            for entry in shard_result:
+                # while rebalancing an entry can be in two shards
+                if entry.entry_id not in seen:
+                    seen.add(entry.entry_id)
+                    result.append(entry)
+        return result
+
+    def add_entry(self, filename, keywords, content="", extra=""):
+        entry_id = make_entry(filename, keywords, content, extra).entry_id
+        with self.lock:
+            if self._rebalancing and self.contains(entry_id):
+                raise FileExistsError("File already added")
+            entry = self.shard_for(entry_id).add_entry(filename, keywords,
+                                                       content, extra)
+        self.generation += 1
+        return entry
+
+    def add_compressed(self, entry, raw_content):
+        with self.lock:
+            if self.contains(entry.entry_id):
+                raise FileExistsError("File already added")
+            self.shard_for(entry.entry_id).insert_entry(entry, raw_content)
+        self.generation += 1
+        return entry
+
+    def add_shard(self, meta_dir):
+        """ Add a shard and move entries to it in the background
+
+        Returns:
+            future of the rebalance
+        """
+        with self.lock:
+            self._open_shard(meta_dir)
+            self._update_routing()
+        return self._executor.submit(self.rebalance)
+
+    @staticmethod
+    def _read_raw(shard, entry):
+        try:
+            return shard.fm.read_raw(entry.entry_id)
+        except FileNotFoundError:
+            log.warning("Missing file of entry %s in shard %s",
+                        entry.entry_id, shard.meta_dir)
+            return zlib.compress(b"")
+
+    def rebalance(self):
+        """ Move every entry to the shard owning it
+
+        Entries are copied before being removed from the old shard, so
+        searches keep finding them while this runs.
+
+        Returns:
+            number of entries moved
+        """
+        moved = 0
+        with self.lock:
+            self._rebalancing = True
+        try:
+            for shard in list(self.shards):
+                moved_ids = []
+                for entry in shard.entries():
+                    if self.shard_for(entry.entry_id) is shard:
+                        continue
+                    # the file is read without blocking the changes
+                    raw_content = self._read_raw(shard, entry)
+                    with self.lock:
+                        owner = self.shard_for(entry.entry_id)
+                        if owner is shard:
+                            continue
+                        if not owner.contains(entry.entry_id):
+                            owner.insert_entry(entry, raw_content)
+                    moved_ids.append(entry.entry_id)
+                if moved_ids:
+                    # the metadata is rewritten out of the lock, it is only
+                    # held to swap it
+                    shard.remove_entries(moved_ids, self.lock)
+                    log.info("Moved %d entries out of shard %s",
+                             len(moved_ids), shard.meta_dir)
+                    moved += len(moved_ids)
+                    _moved.inc(len(moved_ids))
+        finally:
+            with self.lock:
+                self._rebalancing = False
+        if moved:
+            self.generation += 1
+        return moved
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+import asyncio
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from hirnoty.bot_commands import Commands
+from hirnoty.utils import get_source
+from utils import async_test
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.calls = []
+
+    def _message(self, file_id):
+        return SimpleNamespace(document=SimpleNamespace(file_id=file_id))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.calls.append(("send_document", document))
+        if isinstance(document, tuple):
+            return self._message(f"uploaded-{document[0]}")
+        return self._message(document)
+
+    async def download_file_by_id(self, file_id, destination):
+        destination.write(f"content of {file_id}".encode())
+
+    async def send_media_group(self, chat_id, media):
+        self.calls.append(("send_media_group", [item.media
+                                                for item in media]))
+        return [self._message(item.media) for item in media]
+
+
+class FakeBotManager(object):
+    def __init__(self):
+        self.bot = FakeBot()
+        self.last_activity = 0
+
+    def register_handler(self, *args, **kwargs):
+        pass
+
+
+class FakeMessage(dict):
+    def __init__(self, text):
+        super().__init__(text=text)
+        self.chat = SimpleNamespace(id=1)
+        self.replies = []
+
+    async def reply(self, text):
+        self.replies.append(text)
+
+    async def answer(self, text):
+        self.replies.append(text)
+
+
+class SearchCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        config = {"INDEX_DIR": self.tempfolder.name,
+                  "INVERTED_INDEX": True,
+                  "SEARCH_CACHE_SIZE": 16,
+                  "INDEX_SHARDS": None,
+                  "STORAGE_CHAT": None,
+                  "SCRIPT_DIR": get_source("scripts"),
+                  "INGEST_WORKERS": None,
+                  "INGEST_QUEUE_SIZE": 4,
+                  "JOB_LOG_DIR": None}
+        self.bot_manager = FakeBotManager()
+        self.commands = Commands(config, self.bot_manager, None)
+
+    def tearDown(self):
+        self.commands.close()
+        self.tempfolder.cleanup()
+
+    @async_test
+    async def test_known_files_are_sent_in_groups(self):
+        for i in range(12):
+            self.commands._index.add_entry(f"file{i}.txt", "common", b"",
+                                           f"file-id-{i}")
+        self.commands._index.add_entry("local.txt", "common", b"data")
+        message = FakeMessage("/search common")
+        await self.commands.search_command(message)
+        calls = self.bot_manager.bot.calls
+        groups = sorted(len(args) for name, args in calls
+                        if name == "send_media_group")
+        self.assertEqual(groups, [2, 10])
+        uploads = [args for name, args in calls if name == "send_document"]
+        self.assertEqual(len(uploads), 1)
+        self.assertEqual(uploads[0][0], "local.txt")
+        self.assertEqual(message.replies, [])
+        # the uploaded file is forwarded in the next search
+        self.bot_manager.bot.calls.clear()
+        await self.commands.search_command(FakeMessage("/search common"))
+        self.assertFalse(any(name == "send_document" and
+                             isinstance(args, tuple)
+                             for name, args in self.bot_manager.bot.calls))
+
+    @async_test
+    async def test_no_file_found(self):
+        message = FakeMessage("/search nothing")
+        await self.commands.search_command(message)
+        self.assertEqual(message.replies, ["No file found"])
+
+    @async_test
+    async def test_delete(self):
+        entry = self.commands._index.add_entry("file.txt", "common", b"data")
+        self.commands._file_id_cache[entry.entry_id] = "file-id"
+        message = FakeMessage(f"/delete {entry.entry_id}")
+        await self.commands.delete_command(message)
+        self.assertEqual(message.replies, [f"Entry deleted: {entry.entry_id}"])
+        self.assertNotIn(entry.entry_id, self.commands._file_id_cache)
+        message = FakeMessage(f"/delete {entry.entry_id}")
+        await self.commands.delete_command(message)
+        self.assertTrue(message.replies[0].startswith("Error deleting"))
+
+    @async_test
+    async def test_delete_doesnt_block_the_loop(self):
+        entry = self.commands._index.add_entry("file.txt", "common", b"data")
+        locked = threading.Event()
+        release = threading.Event()
+
+        def compaction():
+            with self.commands._index.lock:
+                locked.set()
+                release.wait()
+
+        holder = threading.Thread(target=compaction)
+        holder.start()
+        locked.wait()
+        message = FakeMessage(f"/delete {entry.entry_id}")
+        task = asyncio.ensure_future(self.commands.delete_command(message))
+        # the loop keeps running while the index is locked
+        await asyncio.sleep(0.05)
+        self.assertEqual(message.replies, [])
+        release.set()
+        await task
+        holder.join()
+        self.assertEqual(message.replies, [f"Entry deleted: {entry.entry_id}"])
+
+    @async_test
+    async def test_shutdown_finishes_uploads(self):
+        message = FakeMessage("")
+        message.document = SimpleNamespace(file_id="doc-id",
+                                           file_name="doc.txt")
+        message.caption = "uploaded words"
+        message.media_group_id = None
+        await self.commands.doc_command(message)
+        await self.commands.shutdown()
+        entry = self.commands._index.search("uploaded")[0]
+        self.assertEqual(message.replies, [f"File indexed: {entry.entry_id}"])
+
+    @async_test
+    async def test_schedule(self):
+        message = FakeMessage('/schedule --jitter=-5 check "@every 1m" test')
+        await self.commands.schedule_command(message)
+        self.assertTrue(message.replies[0].startswith("Usage"))
+        message = FakeMessage('/schedule --jitter=5 check "@every 1m" test')
+        await self.commands.schedule_command(message)
+        self.assertEqual(message.replies,
+                         ["check: Scheduled, output sent to topic check"])
+        message = FakeMessage("/unschedule check")
+        await self.commands.unschedule_command(message)
+        self.assertEqual(message.replies, ["check: Unscheduled"])
+
+    @async_test
+    async def test_tail_and_grep(self):
+        job_log = self.commands.job_logs.open("7")
+        for i in range(30):
+            job_log.write(f"line {i}".encode())
+        self.commands.job_logs.close("7")
+        message = FakeMessage("/tail 7 2")
+        await self.commands.tail_command(message)
+        self.assertEqual(message.replies, ["line 28\nline 29\n"])
+        message = FakeMessage("/grep 7 line 1[12]")
+        await self.commands.grep_command(message)
+        self.assertEqual(message.replies, ["12: line 11\n13: line 12\n"])
+        message = FakeMessage("/tail 8")
+        await self.commands.tail_command(message)
+        self.assertTrue(message.replies[0].startswith("Error"))
+
+
+class PrewarmTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.config = {"INDEX_DIR": self.tempfolder.name,
+                       "INVERTED_INDEX": True,
+                       "SEARCH_CACHE_SIZE": 16,
+                       "INDEX_SHARDS": None,
+                       "STORAGE_CHAT": 42,
+                       "PREWARM_BANDWIDTH": 1024 ** 2,
+                       "SCRIPT_DIR": get_source("scripts"),
+                       "INGEST_WORKERS": None,
+                       "INGEST_QUEUE_SIZE": 4,
+                       "JOB_LOG_DIR": None}
+
+    def tearDown(self):
+        self.tempfolder.cleanup()
+
+    @async_test
+    async def test_cache_is_shared_after_restart(self):
+        commands = Commands(self.config, FakeBotManager(), None)
+        commands._index.add_entry("searched.txt", "searched", b"data1")
+        commands._index.add_entry("cold.txt", "cold", b"data2")
+        await commands.search_command(FakeMessage("/search searched"))
+        commands.close()
+
+        bot_manager = FakeBotManager()
+        commands = Commands(self.config, bot_manager, None)
+        self.assertIs(commands.prewarmer.file_id_cache,
+                      commands._file_id_cache)
+        commands.prewarmer.min_interval = 0
+        commands.prewarmer.idle_seconds = 0
+        self.assertEqual(await commands.prewarmer.run_once(), 1)
+        self.assertEqual([args[0] for name, args in bot_manager.bot.calls],
+                         ["cold.txt"])
+        # the id is saved with the rest of the cache
+        commands.close()
+        commands = Commands(self.config, FakeBotManager(), None)
+        self.assertEqual(sorted(commands._file_id_cache.values()),
+                         ["uploaded-cold.txt", "uploaded-searched.txt"])
+        commands.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
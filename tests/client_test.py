@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import unittest
+import zmq
+from hirnoty.client import AsyncClient, Client
+from utils import async_test
+
+
+class ClientTest(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.pull = self.context.socket(zmq.PULL)
+        self.pull.setsockopt(zmq.RCVTIMEO, 2000)
+        port = self.pull.bind_to_random_port("tcp://127.0.0.1")
+        self.addr = f"127.0.0.1:{port}"
+
+    def tearDown(self):
+        self.pull.close()
+        self.context.term()
+
+    def receive(self):
+        topic, data = self.pull.recv_multipart()
+        return topic.decode(), data.decode()
+
+    def test_send(self):
+        with Client(self.addr) as client:
+            client.send("alerts", "one")
+            client.send("alerts", "two")
+        self.assertEqual(self.receive(), ("alerts", "one"))
+        self.assertEqual(self.receive(), ("alerts", "two"))
+
+    def test_batching(self):
+        with Client(self.addr, linger=10) as client:
+            client.send("alerts", "one")
+            client.send("log", "other")
+            client.send("alerts", "two")
+        received = sorted([self.receive(), self.receive()])
+        self.assertEqual(received, [("alerts", "one\ntwo"), ("log", "other")])
+
+    def test_batch_is_sent_when_full(self):
+        client = Client(self.addr, linger=10, max_batch=2)
+        client.send("alerts", "one")
+        client.send("alerts", "two")
+        self.assertEqual(self.receive(), ("alerts", "one\ntwo"))
+        client.close()
+
+    def test_linger_expires(self):
+        client = Client(self.addr, linger=0.01)
+        client.send("alerts", "one")
+        self.assertEqual(self.receive(), ("alerts", "one"))
+        client.close()
+
+    @async_test
+    async def test_async_batching(self):
+        async with AsyncClient(self.addr, linger=10) as client:
+            await client.send("alerts", "one")
+            await client.send("alerts", "two")
+        self.assertEqual(self.receive(), ("alerts", "one\ntwo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import unittest
+from collections import Counter
+from benchmarks.corpus import Corpus
+from benchmarks.index_bench import compare
+
+
+class CorpusTest(unittest.TestCase):
+    def test_deterministic(self):
+        self.assertEqual(list(Corpus(3).entries(50)),
+                         list(Corpus(3).entries(50)))
+        self.assertNotEqual(list(Corpus(3).entries(50)),
+                            list(Corpus(4).entries(50)))
+        self.assertEqual(list(Corpus(3).queries(20)),
+                         list(Corpus(3).queries(20)))
+
+    def test_contents_are_unique(self):
+        contents = [entry.content for entry in
+                    Corpus(content_fraction=1).entries(200)]
+        self.assertTrue(all(contents))
+        self.assertEqual(len(set(contents)), len(contents))
+
+    def test_zipf_distribution(self):
+        corpus = Corpus(vocabulary_size=1000)
+        counts = Counter(word for entry in corpus.entries(2000)
+                         for word in entry.keywords.split())
+        # the most popular word must be much more frequent than the median
+        frequencies = sorted(counts.values(), reverse=True)
+        self.assertGreater(frequencies[0],
+                           10 * frequencies[len(frequencies) // 2])
+        self.assertEqual(counts.most_common(1)[0][0], corpus.vocabulary[0])
+
+
+class CompareTest(unittest.TestCase):
+    def test_regressions(self):
+        baseline = {"case": {"add_per_sec": 100, "load_s": 1.0,
+                             "entries": 10}}
+        results = {"case": {"add_per_sec": 70, "load_s": 1.1, "entries": 20}}
+        regressions = compare(results, baseline, 0.2)
+        self.assertEqual([(name, metric) for name, metric, *_ in regressions],
+                         [("case", "add_per_sec")])
+
+
+if __name__ == "__main__":
+    unittest.main()
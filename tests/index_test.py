@@ -104,15 +104,100 @@ class IndexTest(unittest.TestCase):
         self.assertEqual(result[1].keywords, EXAMPLE2_KEYWORDS)
         self.assertEqual(result[1].extra, EXAMPLE2_EXTRA)
 
+    def test_search_cache_invalidated_on_add(self):
+        self.assertEqual(len(self.index.search("example")), 2)
+        self.assertEqual(len(self.index.search(" example ")), 2)
+        generation = self.index.generation
+        self.index.add_entry("example_file4.pdf", "more", b"content4")
+        self.assertEqual(self.index.generation, generation + 1)
+        self.assertEqual(len(self.index.search("example")), 3)
+
     def test_double_adding(self):
         self.assertRaises(FileExistsError, self.index.add_entry, "no matter",
                           "never mind", EXAMPLE1_CONTENT)
 
+    def test_delete_entry(self):
+        self.index.delete_entry(EXAMPLE1_ENTRY_ID)
+        self.assertEqual(self.index.search("keywords"), [])
+        self.assertEqual(len(self.index.search("example")), 1)
+        self.assertFalse(self.index.contains(EXAMPLE1_ENTRY_ID))
+        self.assertRaises(KeyError, self.index.delete_entry,
+                          EXAMPLE1_ENTRY_ID)
+
+    def test_delete_survives_reopening(self):
+        self.index.delete_entry(EXAMPLE1_ENTRY_ID)
+        self.index.close()
+        self.create_index()
+        self.assertEqual(self.index.search("keywords"), [])
+        self.assertEqual(len(list(self.index.entries())), 2)
+
+    def test_add_after_delete(self):
+        self.index.delete_entry(EXAMPLE1_ENTRY_ID)
+        self.index.add_entry(EXAMPLE1_FILENAME, EXAMPLE1_KEYWORDS,
+                             EXAMPLE1_CONTENT, EXAMPLE1_EXTRA)
+        self.index.close()
+        self.create_index()
+        self.assertEqual(len(self.index.search("keywords")), 1)
+        self.test_saved_content()
+
+    def test_compact(self):
+        self.index.delete_entry(EXAMPLE2_ENTRY_ID)
+        parts = self.index.parts()
+        self.assertEqual(sum(part.dead_entries for part in parts), 2)
+        self.assertEqual(sum(part.compact() for part in parts), 2)
+        self.assertEqual(sum(part.dead_entries for part in parts), 0)
+        for part in parts:
+            with open(part.meta_path) as fhandle:
+                self.assertNotIn(EXAMPLE2_ENTRY_ID, fhandle.read())
+        self.index.close()
+        self.create_index()
+        self.assertEqual(len(self.index.search("example")), 1)
+
+    def test_changes_while_compacting_are_kept(self):
+        self.index.delete_entry(EXAMPLE3_ENTRY_ID)
+        changes = [lambda: self.index.add_entry("example_file4.pdf", "more",
+                                                b"content4"),
+                   lambda: self.index.delete_entry(EXAMPLE1_ENTRY_ID)]
+        for part in self.index.parts():
+            def build_state(entries, build_state=part.engine.build_state):
+                # made while the new metadata is written
+                while changes:
+                    changes.pop(0)()
+                return build_state(entries)
+            part.engine.build_state = build_state
+        for part in self.index.parts():
+            part.compact()
+        expected = ["example_file2.pdf", "example_file4.pdf"]
+        self.assertEqual(sorted(entry.filename for entry
+                                in self.index.search("example")), expected)
+        self.index.close()
+        self.create_index()
+        self.assertEqual(sorted(entry.filename for entry
+                                in self.index.search("example")), expected)
+
+    @async_test
+    async def test_asearch(self):
+        self.assertEqual(await self.index.asearch(" example "),
+                         self.index.search("example"))
+
 
 class InvertedIndexTest(IndexTest):
     def create_index(self):
         self.index = SimpleIndex(self.tempfolder_path, None, True)
 
+    def test_searches_while_reloading_see_old_data(self):
+        engine = self.index.engine
+        words = engine._words
+        seen = []
+
+        def searching_words(entry):
+            seen.append(len(engine.search("example")))
+            return words(entry)
+        engine._words = searching_words
+        engine.load_data()
+        self.assertTrue(seen)
+        self.assertEqual(set(seen), {2})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import asyncio
+import tempfile
+import unittest
+from hirnoty.index import SimpleIndex
+from hirnoty.ingest import IngestPipeline, Upload
+from utils import async_test
+
+
+class FakeBot(object):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.running = 0
+        self.max_running = 0
+
+    async def download_file_by_id(self, file_id, destination):
+        if file_id.startswith("broken"):
+            raise IOError("download failed")
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(self.latency)
+        self.running -= 1
+        destination.write(f"content of {file_id}".encode())
+
+
+class Replies(object):
+    def __init__(self):
+        self.messages = []
+        self.received = asyncio.Event()
+
+    async def __call__(self, text):
+        self.messages.append(text)
+        self.received.set()
+
+
+class IngestPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.index = SimpleIndex(self.tempfolder.name)
+
+    def tearDown(self):
+        self.index.close()
+        self.tempfolder.cleanup()
+
+    async def ingest(self, uploads, bot=None, **kwargs):
+        pipeline = IngestPipeline(bot or FakeBot(), self.index,
+                                  group_wait=0.05, **kwargs)
+        for upload in uploads:
+            await pipeline.submit(upload)
+        for _ in range(200):
+            if all(upload.result for upload in uploads):
+                break
+            await asyncio.sleep(0.01)
+        await pipeline.close()
+
+    @async_test
+    async def test_single_upload(self):
+        replies = Replies()
+        await self.ingest([Upload("id1", "file1.txt", "some words",
+                                  replies)])
+        entry = self.index.search("words")[0]
+        self.assertEqual(replies.messages,
+                         [f"File indexed: {entry.entry_id}"])
+        self.assertEqual(entry.extra, "id1")
+        self.assertEqual(self.index.get_file(entry.entry_id).read(),
+                         b"content of id1")
+
+    @async_test
+    async def test_duplicated_upload(self):
+        replies = Replies()
+        await self.ingest([Upload("id1", "file1.txt", "a", replies),
+                           Upload("id1", "file2.txt", "b", replies)])
+        self.assertEqual(len(list(self.index.entries())), 1)
+        self.assertIn("File already added", replies.messages)
+
+    @async_test
+    async def test_broken_download_is_indexed_without_content(self):
+        replies = Replies()
+        await self.ingest([Upload("broken", "file.txt", "words", replies)])
+        self.assertTrue(replies.messages[0].startswith("Error downloading"))
+        self.assertTrue(replies.messages[1].startswith("File indexed"))
+        self.assertEqual(self.index.search("words")[0].entry_type, "A")
+
+    @async_test
+    async def test_album_shares_caption_and_reply(self):
+        replies = Replies()
+        uploads = [Upload(f"id{i}", f"file{i}.txt",
+                          "album words" if i == 1 else None, replies, "g1")
+                   for i in range(5)]
+        await self.ingest(uploads)
+        self.assertEqual(len(self.index.search("album")), 5)
+        self.assertEqual(len(replies.messages), 1)
+        self.assertTrue(replies.messages[0].startswith(
+            "5 of 5 files indexed"))
+
+    @async_test
+    async def test_concurrency_is_bounded(self):
+        bot = FakeBot(latency=0.01)
+        replies = Replies()
+        await self.ingest([Upload(f"id{i}", f"file{i}.txt", "burst", replies)
+                           for i in range(30)], bot,
+                          workers={"download": 3}, queue_size=2)
+        self.assertEqual(len(self.index.search("burst")), 30)
+        self.assertEqual(bot.max_running, 3)
+
+    @async_test
+    async def test_slow_replies_dont_stop_indexing(self):
+        async def slow_reply(text):
+            await asyncio.sleep(10)
+
+        pipeline = IngestPipeline(FakeBot(), self.index)
+        for i in range(10):
+            await pipeline.submit(Upload(f"id{i}", f"file{i}.txt", "slow",
+                                         slow_reply))
+        for _ in range(100):
+            if len(self.index.search("slow")) == 10:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(self.index.search("slow")), 10)
+        await pipeline.close()
+
+    @async_test
+    async def test_close_waits_for_submitted_uploads(self):
+        replies = Replies()
+        pipeline = IngestPipeline(FakeBot(latency=0.01), self.index,
+                                  group_wait=60)
+        for i in range(10):
+            await pipeline.submit(Upload(f"id{i}", f"file{i}.txt", "waited",
+                                         replies, "g1" if i < 3 else None))
+        await pipeline.close(wait=True)
+        self.assertEqual(len(self.index.search("waited")), 10)
+        self.assertEqual(len(replies.messages), 8)
+
+    @async_test
+    async def test_album_after_close_is_ignored(self):
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context))
+        pipeline = IngestPipeline(FakeBot(), self.index, group_wait=0.01)
+        await pipeline.submit(Upload("id1", "file1.txt", "late", Replies(),
+                                     "g1"))
+        await pipeline.close()
+        await asyncio.sleep(0.05)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.index.search("late"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import os
+import stat
+import tempfile
+import unittest
+from hirnoty.joblog import STDERR, GrepTimeout, JobLogStore
+from hirnoty.jobs import Runner
+from utils import async_test
+
+
+class JobLogTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.store = JobLogStore(self.tempfolder.name, chunk_size=1024,
+                                 ring_lines=10, keep=3)
+
+    def tearDown(self):
+        self.tempfolder.cleanup()
+
+    def write_job(self, job_id, lines):
+        job_log = self.store.open(job_id)
+        for i in range(lines):
+            job_log.write(f"line {i}\n".encode())
+        return job_log
+
+    def test_tail_reads_only_last_chunks(self):
+        self.write_job("1", 1000)
+        self.store.close("1")
+        chunks = self.store.chunks("1")
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(sum(chunk[3] for chunk in chunks), 1000)
+        read = []
+        read_chunk = self.store.read_chunk
+        self.store.read_chunk = lambda job_id, chunk: \
+            read.append(chunk) or read_chunk(job_id, chunk)
+        self.assertEqual(self.store.tail("1", 3),
+                         ["line 997\n", "line 998\n", "line 999\n"])
+        self.assertEqual(len(read), 1)
+        lines = self.store.tail("1", 150)
+        self.assertEqual(lines[0], "line 850\n")
+        self.assertEqual(len(lines), 150)
+
+    def test_grep(self):
+        self.write_job("1", 1000)
+        self.store.close("1")
+        self.assertEqual(self.store.grep("1", r"line 12\d$"),
+                         [(121 + i, f"line 12{i}\n") for i in range(10)])
+        self.assertEqual(len(self.store.grep("1", "line", 5)), 5)
+
+    def test_grep_time_budget(self):
+        self.write_job("1", 1000)
+        self.store.close("1")
+        with self.assertRaises(GrepTimeout) as context:
+            self.store.grep("1", "line", seconds=1e-9)
+        self.assertEqual(context.exception.matches, [])
+
+    def test_running_job(self):
+        job_log = self.write_job("1", 100)
+        job_log.write(b"error", STDERR)
+        # the last lines come from memory
+        self.assertEqual(self.store.tail("1", 2),
+                         ["line 99\n", "stderr: error\n"])
+        self.assertEqual(len(self.store.tail("1", 101)), 101)
+        self.assertEqual(self.store.grep("1", "error"),
+                         [(101, "stderr: error\n")])
+        self.store.close("1")
+
+    def test_old_logs_are_removed(self):
+        for job_id in ["1", "2", "3", "4", "5"]:
+            self.write_job(job_id, 1)
+            self.store.close(job_id)
+            os.utime(os.path.join(self.tempfolder.name, job_id + ".log"),
+                     (int(job_id), int(job_id)))
+        self.assertRaises(KeyError, self.store.tail, "1", 1)
+        self.assertEqual(self.store.tail("5", 1), ["line 0\n"])
+        self.assertRaises(KeyError, self.store.tail, "../1", 1)
+
+    @async_test
+    async def test_runner_output_is_archived(self):
+        script_dir = tempfile.TemporaryDirectory()
+        script = os.path.join(script_dir.name, "noisy.sh")
+        with open(script, "w") as fhandle:
+            fhandle.write("#!/bin/sh\nfor i in $(seq 300); do echo out $i; "
+                          "done\necho oops >&2\n")
+        os.chmod(script, stat.S_IRWXU)
+        runner = Runner(script_dir.name, "noisy", [], self.store)
+        output = [line async for line in runner.work()]
+        script_dir.cleanup()
+        job_id = str(runner.process.pid)
+        self.assertIn(f"{job_id} (stderr): oops\n", output)
+        self.assertEqual(self.store.running, {})
+        self.assertEqual(self.store.tail(job_id, 1), ["stderr: oops\n"])
+        self.assertEqual(self.store.grep(job_id, "out 300"),
+                         [(300, "out 300\n")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
+import asyncio
+import os
+import stat
+import tempfile
 import unittest
+from os import path
+from hirnoty.joblog import JobLogStore
 from hirnoty.jobs import Runner
 from hirnoty.utils import get_source
 from utils import async_test
@@ -15,6 +21,26 @@ class JobsTest(unittest.TestCase):
         self.assertTrue(
             result[0].endswith("Test script called with OK Passed\n"))
 
+    @async_test
+    async def test_long_line_raises(self):
+        with tempfile.TemporaryDirectory() as script_dir:
+            script = path.join(script_dir, "long.sh")
+            with open(script, "w") as fhandle:
+                fhandle.write("#!/bin/sh\nhead -c 100000 /dev/zero | "
+                              "tr '\\0' x\necho\nexec sleep 60\n")
+            os.chmod(script, stat.S_IRWXU)
+            job_logs = JobLogStore(path.join(script_dir, "jobs"))
+            runner = Runner(script_dir, "long", [], job_logs)
+            with self.assertRaises(ValueError):
+                await asyncio.wait_for(
+                    self._consume(runner), timeout=10)
+            self.assertIsNotNone(runner.process.returncode)
+            self.assertEqual(job_logs.running, {})
+
+    @staticmethod
+    async def _consume(runner):
+        return [item async for item in runner.work()]
+
     def test_sanitize_template(self):
         self.assertEqual(Runner._sanitize_template("abCD123-..+=4/5"),
                          "abCD123-45")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import asyncio
+import tempfile
+import threading
+import unittest
+import zlib
+from hirnoty.index import SimpleIndex
+from hirnoty.maintenance import IndexMaintainer
+from utils import async_test
+
+
+class IndexMaintainerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.index = SimpleIndex(self.tempfolder.name, None, True)
+        self.entries = [self.index.add_entry(f"file{i}.txt", "common",
+                                             f"content {i}".encode())
+                        for i in range(10)]
+        self.maintainer = IndexMaintainer(self.index, pause_seconds=0,
+                                          grace_seconds=0)
+
+    def tearDown(self):
+        self.index.close()
+        self.tempfolder.cleanup()
+
+    @async_test
+    async def test_clean_index(self):
+        report = await self.maintainer.run_once()
+        self.assertEqual(report["orphans"], 0)
+        self.assertEqual(report["compacted_lines"], 0)
+        self.assertEqual(report["verified"], 10)
+        self.assertEqual(report["corrupt"], [])
+
+    @async_test
+    async def test_deleted_entries_are_collected(self):
+        for entry in self.entries[:5]:
+            self.index.delete_entry(entry.entry_id)
+        report = await self.maintainer.run_once()
+        self.assertEqual(report["orphans"], 5)
+        self.assertGreater(report["reclaimed_bytes"], 0)
+        self.assertEqual(report["compacted_lines"], 10)
+        self.assertEqual(self.index.dead_entries, 0)
+        for entry in self.entries[:5]:
+            self.assertFalse(self.index.fm.contains(entry.entry_id))
+        for entry in self.entries[5:]:
+            self.assertTrue(self.index.fm.contains(entry.entry_id))
+        self.assertEqual(len(self.index.search("common")), 5)
+
+    @async_test
+    async def test_adds_wait_for_compaction(self):
+        # a compaction in other thread holds the lock
+        locked = threading.Event()
+        release = threading.Event()
+
+        def compaction():
+            with self.index.lock:
+                locked.set()
+                release.wait()
+
+        holder = threading.Thread(target=compaction)
+        holder.start()
+        locked.wait()
+        added = asyncio.get_running_loop().run_in_executor(
+            None, self.index.add_entry, "new.txt", "common", b"new")
+        await asyncio.sleep(0.05)
+        self.assertFalse(added.done())
+        release.set()
+        await added
+        holder.join()
+        self.assertEqual(len(self.index.search("common")), 11)
+
+    @async_test
+    async def test_recent_orphans_are_kept(self):
+        self.maintainer.grace_seconds = 600
+        self.index.delete_entry(self.entries[0].entry_id)
+        report = await self.maintainer.run_once()
+        self.assertEqual(report["orphans"], 0)
+        self.assertTrue(self.index.fm.contains(self.entries[0].entry_id))
+
+    @async_test
+    async def test_corrupt_file_is_reported(self):
+        entry_id = self.entries[3].entry_id
+        self.index.fm.write_raw(entry_id, zlib.compress(b"tampered"))
+        report = await self.maintainer.run_once()
+        self.assertEqual(report["corrupt"], [entry_id])
+        self.assertEqual(report["verified"], 9)
+
+    @async_test
+    async def test_verification_is_incremental(self):
+        self.maintainer.verify_batch = 4
+        verified = [(await self.maintainer.run_once())["verified"]
+                    for _ in range(4)]
+        self.assertEqual(verified, [4, 4, 2, 4])
+        report = IndexMaintainer.format_report(self.maintainer.last_report)
+        self.assertIn("verified 4 files", report)
+
+
+if __name__ == "__main__":
+    unittest.main()
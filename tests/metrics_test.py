@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import unittest
+from hirnoty.metrics import Registry
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_same_metric_is_returned(self):
+        counter = self.registry.counter("requests_total", handler="a")
+        self.assertIs(self.registry.counter("requests_total", handler="a"),
+                      counter)
+        self.assertIsNot(self.registry.counter("requests_total", handler="b"),
+                         counter)
+
+    def test_type_mismatch(self):
+        self.registry.counter("something")
+        self.assertRaises(ValueError, self.registry.gauge, "something")
+
+    def test_histogram_buckets(self):
+        histogram = self.registry.histogram("latency_seconds",
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+
+    def test_render(self):
+        self.registry.counter("hits_total", "Number of hits", kind="x").inc(3)
+        self.registry.gauge("level").set(1.5)
+        self.registry.histogram("wait_seconds", buckets=(1.0,)).observe(0.5)
+        self.assertEqual(self.registry.render(),
+                         '# HELP hits_total Number of hits\n'
+                         '# TYPE hits_total counter\n'
+                         'hits_total{kind="x"} 3\n'
+                         '# TYPE level gauge\n'
+                         'level 1.5\n'
+                         '# TYPE wait_seconds histogram\n'
+                         'wait_seconds_bucket{le="1"} 1\n'
+                         'wait_seconds_bucket{le="+Inf"} 1\n'
+                         'wait_seconds_sum 0.5\n'
+                         'wait_seconds_count 1\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from aiogram.utils.exceptions import RetryAfter
+from hirnoty.index import SimpleIndex
+from hirnoty.prewarm import Prewarmer
+from utils import async_test
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.uploads = []
+        self.rate_limited = 0
+
+    async def send_document(self, chat_id, document, **kwargs):
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise RetryAfter(0)
+        self.uploads.append((chat_id, document[0], document[1].read()))
+        return SimpleNamespace(
+            document=SimpleNamespace(file_id=f"id-{document[0]}"))
+
+
+class PrewarmerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.index = SimpleIndex(self.tempfolder.name)
+        self.entries = [self.index.add_entry(f"file{i}.txt", f"word{i}",
+                                             f"content {i}".encode())
+                        for i in range(5)]
+        # already known by telegram
+        self.index.add_entry("known.txt", "word0", b"known", "known-id")
+        self.bot_manager = SimpleNamespace(bot=FakeBot(), last_activity=0)
+        self.cache = {}
+        self.prewarmer = Prewarmer(self.index, self.bot_manager, self.cache,
+                                   42, min_interval=0, idle_seconds=0)
+
+    def tearDown(self):
+        self.index.close()
+        self.tempfolder.cleanup()
+
+    @async_test
+    async def test_uploads_cold_files(self):
+        self.cache[self.entries[0].entry_id] = "cached-id"
+        self.assertEqual(await self.prewarmer.run_once(), 4)
+        uploads = self.bot_manager.bot.uploads
+        self.assertEqual(sorted(name for _, name, _ in uploads),
+                         ["file1.txt", "file2.txt", "file3.txt", "file4.txt"])
+        self.assertTrue(all(chat_id == 42 for chat_id, _, _ in uploads))
+        self.assertEqual(self.cache[self.entries[3].entry_id],
+                         "id-file3.txt")
+        self.assertIn(("file3.txt", b"content 3"),
+                      [(name, data) for _, name, data in uploads])
+        self.assertEqual(await self.prewarmer.run_once(), 0)
+
+    @async_test
+    async def test_searched_files_go_first(self):
+        self.prewarmer.record_search(self.index.search("word3"))
+        self.prewarmer.record_search(self.index.search("word3"))
+        self.prewarmer.record_search(self.index.search("word1"))
+        self.assertEqual([entry.filename for entry in
+                          self.prewarmer.pending()[:2]],
+                         ["file3.txt", "file1.txt"])
+
+    @async_test
+    async def test_stops_when_busy(self):
+        self.prewarmer.idle_seconds = 60
+        self.bot_manager.last_activity = time.monotonic()
+        self.assertEqual(await self.prewarmer.run_once(), 0)
+        self.assertEqual(self.bot_manager.bot.uploads, [])
+
+    @async_test
+    async def test_rate_limit(self):
+        self.bot_manager.bot.rate_limited = 1
+        self.assertEqual(await self.prewarmer.run_once(), 4)
+        self.assertEqual(await self.prewarmer.run_once(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
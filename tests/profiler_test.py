@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import time
+import unittest
+from urllib.request import urlopen
+from hirnoty.metrics import registry, start_http_server
+from hirnoty.profiler import ProfileInProgress, handle_profile, profile
+from utils import async_test
+
+
+def busy(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+class ProfilerTest(unittest.TestCase):
+    @async_test
+    async def test_profile(self):
+        loop = asyncio.get_running_loop()
+        latency = registry.histogram("hirnoty_test_profiled_seconds")
+
+        def blocking():
+            with latency.time():
+                busy(0.2)
+        loop.call_later(0.05, blocking)
+        result = await profile(0.5, slow_callback_duration=0.1)
+        self.assertFalse(loop.get_debug())
+        self.assertGreater(result.sampler.samples, 10)
+        self.assertIn("profiler_test.py:busy", result.collapsed())
+        self.assertEqual(len(result.slow_callbacks), 1)
+        self.assertIn("blocking", result.slow_callbacks[0][1])
+        self.assertEqual(result.timings[0][1:],
+                         (1, "hirnoty_test_profiled_seconds"))
+        report = result.report()
+        self.assertIn("hirnoty_test_profiled_seconds: n=1", report)
+        self.assertIn("profiler_test.py:busy", report)
+
+    @async_test
+    async def test_one_profile_at_a_time(self):
+        first = asyncio.ensure_future(profile(0.2))
+        await asyncio.sleep(0)
+        with self.assertRaises(ProfileInProgress):
+            await profile(0.1)
+        await first
+
+    @async_test
+    async def test_http_route(self):
+        runner = await start_http_server("127.0.0.1:0",
+                                         routes={"/profile": handle_profile})
+        port = runner.addresses[0][1]
+
+        def fetch():
+            with urlopen(f"http://127.0.0.1:{port}/profile?seconds=0.2") \
+                    as response:
+                return json.load(response)
+        result = await asyncio.get_running_loop().run_in_executor(None,
+                                                                  fetch)
+        await runner.cleanup()
+        self.assertIn("Profile of", result["report"])
+        self.assertIn("collapsed", result)
+
+
+if __name__ == "__main__":
+    unittest.main()
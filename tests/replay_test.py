@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import unittest
+from benchmarks.replay import Tracker, update_kind
+
+
+def make_update(message_id, text, chat_id=1):
+    return {"update_id": message_id,
+            "message": {"message_id": message_id, "text": text,
+                        "chat": {"id": chat_id, "type": "private"}}}
+
+
+class TrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = Tracker()
+
+    def test_update_kind(self):
+        self.assertEqual(update_kind(make_update(1, "/search a b")), "search")
+        self.assertEqual(update_kind(make_update(1, "/exec@bot x")), "exec")
+        self.assertEqual(update_kind(make_update(1, "hello")), "other")
+
+    def test_replies_go_to_oldest_unanswered_update(self):
+        self.tracker.update_sent(make_update(1, "/ping"))
+        self.tracker.update_sent(make_update(2, "/exec test"))
+        for text in ("pong", "1: line", "1: Finished with rc 0"):
+            self.tracker.on_message("sendMessage", 1, {"text": text})
+        report = self.tracker.report()["updates"]
+        self.assertEqual(report["ping"]["answered"], 1)
+        self.assertEqual(report["ping"]["replies"], 1)
+        self.assertEqual(report["exec"]["answered"], 1)
+        self.assertEqual(report["exec"]["replies"], 2)
+
+    def test_quoted_replies(self):
+        self.tracker.update_sent(make_update(1, "/ping"))
+        self.tracker.update_sent(make_update(2, "/search x"))
+        self.tracker.on_message("sendMessage", 1,
+                                {"text": "No file found",
+                                 "reply_to_message_id": 2})
+        report = self.tracker.report()["updates"]
+        self.assertEqual(report["ping"]["answered"], 0)
+        self.assertEqual(report["search"]["answered"], 1)
+
+    def test_notifications(self):
+        self.tracker.notification_sent("alerts", "disk full")
+        self.tracker.notification_sent("alerts", "cpu")
+        self.tracker.on_message("sendMessage", 1, {"text": "alerts: cpu"})
+        self.tracker.on_message("sendMessage", 2, {"text": "alerts: cpu"})
+        report = self.tracker.report()["notifications"]["alerts"]
+        self.assertEqual(report["sent"], 2)
+        self.assertEqual(report["delivered"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime
+from hirnoty.jobs import ScriptNotFound
+from hirnoty.scheduler import (CronSpec, Schedule, Scheduler, TimingWheel,
+                               parse_spec)
+from hirnoty.utils import get_source
+from utils import async_test
+
+
+def local(*args):
+    return datetime(*args).timestamp()
+
+
+class FakeMQ(object):
+    def __init__(self):
+        self.messages = []
+
+    async def notify(self, topic, data):
+        self.messages.append((topic, data))
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TimingWheelTest(unittest.TestCase):
+    def test_items_expire_in_their_tick(self):
+        # small wheel, so every level and the overflow are used
+        wheel = TimingWheel(levels=3, bits=3)
+        rng = random.Random(0)
+        expected = {}
+        for i in range(2000):
+            expected[i] = rng.randint(1, 1500)
+            wheel.add(expected[i], i)
+        expired = {}
+        for _ in range(1500):
+            for item in wheel.advance():
+                expired[item] = wheel.current
+        self.assertEqual(expired, expected)
+
+    def test_past_ticks_expire_next(self):
+        wheel = TimingWheel()
+        for _ in range(10):
+            wheel.advance()
+        wheel.add(3, "late")
+        self.assertEqual(wheel.advance(), ["late"])
+
+
+class CronSpecTest(unittest.TestCase):
+    def test_every_five_minutes(self):
+        spec = CronSpec("*/5 * * * *")
+        self.assertEqual(spec.next_after(local(2024, 1, 1, 10, 2, 30)),
+                         local(2024, 1, 1, 10, 5))
+        self.assertEqual(spec.next_after(local(2024, 1, 1, 10, 5)),
+                         local(2024, 1, 1, 10, 10))
+
+    def test_ranges_and_lists(self):
+        spec = CronSpec("30 9-17/4 * * 1-5")
+        # saturday
+        self.assertEqual(spec.next_after(local(2024, 1, 6, 12, 0)),
+                         local(2024, 1, 8, 9, 30))
+        self.assertEqual(spec.next_after(local(2024, 1, 8, 9, 30)),
+                         local(2024, 1, 8, 13, 30))
+
+    def test_day_or_weekday(self):
+        # the 1st of the month or any sunday
+        spec = CronSpec("0 0 1 * 0")
+        self.assertEqual(spec.next_after(local(2024, 1, 1, 0, 0)),
+                         local(2024, 1, 7, 0, 0))
+        self.assertEqual(spec.next_after(local(2024, 1, 28, 0, 0)),
+                         local(2024, 2, 1, 0, 0))
+
+    def test_aliases(self):
+        self.assertEqual(CronSpec("@monthly").next_after(
+            local(2024, 2, 10)), local(2024, 3, 1))
+        self.assertEqual(parse_spec("@every 2m").next_after(100), 220)
+
+    def test_invalid(self):
+        for text in ["* * * *", "60 * * * *", "*/0 * * * *", "a * * * *",
+                     "@every 0s", "0 0 30 2 *"]:
+            self.assertRaises(ValueError,
+                              lambda: parse_spec(text).next_after(0))
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempfolder.name, "schedules.json")
+        self.clock = FakeClock(1000.0)
+        self.mq = FakeMQ()
+        self.scheduler = self.create_scheduler()
+
+    def tearDown(self):
+        self.tempfolder.cleanup()
+
+    def create_scheduler(self):
+        return Scheduler(get_source("scripts"), self.mq, self.path,
+                         clock=self.clock)
+
+    async def run_until(self, timestamp):
+        """ Move the clock, waiting for the jobs after each second """
+        fired = []
+        while self.clock.now < timestamp:
+            self.clock.now += 1
+            fired.extend(schedule.name
+                         for schedule in self.scheduler.run_pending())
+            await asyncio.gather(*self.scheduler.running_tasks())
+        return fired
+
+    @async_test
+    async def test_interval_publishes_output(self):
+        self.scheduler.add(Schedule("check", "@every 10s", "test", ["OK"]))
+        self.assertEqual(await self.run_until(1035), ["check"] * 3)
+        outputs = [data for topic, data in self.mq.messages
+                   if topic == "check" and "called" in data]
+        self.assertEqual(len(outputs), 3)
+        self.assertTrue(outputs[0].endswith("Test script called with OK"))
+
+    @async_test
+    async def test_skip_if_running(self):
+        self.scheduler.add(Schedule("a", "@every 1s", "test"))
+        self.scheduler.add(Schedule("b", "@every 1s", "test",
+                                    skip_if_running=False))
+        # jobs don't make progress, the clock runs faster
+        fired = []
+        for _ in range(3):
+            self.clock.now += 1
+            fired.extend(schedule.name
+                         for schedule in self.scheduler.run_pending())
+        self.assertEqual(fired.count("b"), 3)
+        self.assertEqual(fired.count("a"), 3)
+        self.assertTrue(self.scheduler.is_running("a"))
+        # one run of a and three of b
+        tasks = self.scheduler.running_tasks()
+        self.assertEqual(len(tasks), 4)
+        await asyncio.gather(*tasks)
+        self.assertFalse(self.scheduler.is_running("a"))
+        self.assertEqual(self.scheduler.running_tasks(), [])
+        finished = [topic for topic, data in self.mq.messages
+                    if "Finished" in data]
+        self.assertEqual(sorted(finished), ["a", "b", "b", "b"])
+
+    @async_test
+    async def test_jitter(self):
+        self.scheduler.add(Schedule("a", "@every 100s", "test", jitter=50))
+        schedule = self.scheduler.schedules["a"]
+        self.assertEqual(schedule.next_time, 1100)
+        self.assertTrue(1100 <= schedule.next_run <= 1150)
+        await self.run_until(1151)
+        self.assertEqual(schedule.next_time, 1200)
+
+    @async_test
+    async def test_remove(self):
+        self.scheduler.add(Schedule("a", "@every 5s", "test"))
+        self.scheduler.remove("a")
+        self.assertEqual(await self.run_until(1020), [])
+        self.assertRaises(KeyError, self.scheduler.remove, "a")
+
+    def test_persistence(self):
+        self.scheduler.add(Schedule("a", "*/5 * * * *", "test", ["x y"],
+                                    topic="alerts", jitter=3))
+        scheduler = self.create_scheduler()
+        schedule = scheduler.schedules["a"]
+        self.assertEqual(schedule.to_dict(),
+                         self.scheduler.schedules["a"].to_dict())
+        self.assertEqual(schedule.args, ["x y"])
+
+    def test_negative_jitter(self):
+        self.assertRaises(ValueError, Schedule, "a", "@every 5s", "test",
+                          jitter=-1)
+
+    def test_missing_script(self):
+        self.assertRaises(ScriptNotFound, self.scheduler.add,
+                          Schedule("a", "@every 5s", "missing"))
+        self.assertEqual(self.scheduler.schedules, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
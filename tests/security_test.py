@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from hirnoty.security import BanList, OTPStore
+
+
+class OTPStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.otp_path = os.path.join(self.tempfolder.name, "otp.txt")
+        with open(self.otp_path, "w") as fhandle:
+            fhandle.write("first\nsecond\nthird\n")
+
+    def tearDown(self):
+        self.tempfolder.cleanup()
+
+    def test_consumed_from_the_end(self):
+        store = OTPStore(self.otp_path)
+        self.assertIsNone(store.consume("/ping second"))
+        self.assertEqual(store.consume("/ping third"), "third")
+        self.assertIsNone(store.consume("/ping third"))
+        self.assertEqual(store.consume("/ping second"), "second")
+        self.assertEqual(store.consume("/ping first"), "first")
+        self.assertIsNone(store.consume("/ping "))
+        store.close()
+
+    def test_otp_file_is_not_rewritten(self):
+        store = OTPStore(self.otp_path)
+        store.consume("third")
+        store.close()
+        with open(self.otp_path, "r") as fhandle:
+            self.assertEqual(fhandle.read(), "first\nsecond\nthird\n")
+
+    def test_consumption_survives_reload(self):
+        store = OTPStore(self.otp_path)
+        store.consume("third")
+        store.close()
+        store = OTPStore(self.otp_path)
+        self.assertEqual(store.remaining, 2)
+        self.assertIsNone(store.consume("third"))
+        self.assertEqual(store.consume("second"), "second")
+        store.close()
+
+    def test_new_otp_file_resets_log(self):
+        store = OTPStore(self.otp_path)
+        store.consume("third")
+        store.close()
+        with open(self.otp_path, "w") as fhandle:
+            fhandle.write("one\ntwo\n")
+        store = OTPStore(self.otp_path)
+        self.assertEqual(store.remaining, 2)
+        self.assertEqual(store.consume("two"), "two")
+        store.close()
+
+
+class BanListTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.bans = BanList(lambda: self.now)
+
+    def test_ban_expires(self):
+        self.bans.ban(1, 30)
+        self.assertTrue(self.bans.is_banned(1))
+        self.assertFalse(self.bans.is_banned(2))
+        self.now = 30
+        self.assertFalse(self.bans.is_banned(1))
+        self.assertEqual(len(self.bans), 0)
+
+    def test_ban_again_extends(self):
+        self.bans.ban(1, 30)
+        self.now = 20
+        self.bans.ban(1, 30)
+        self.now = 40
+        self.assertTrue(self.bans.is_banned(1))
+        self.now = 50
+        self.assertFalse(self.bans.is_banned(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from hirnoty.sharded_index import ShardedIndex
+import index_test
+
+
+class ShardedIndexTest(index_test.IndexTest):
+    def create_index(self):
+        dirs = []
+        for i in range(3):
+            dirs.append(os.path.join(self.tempfolder_path, f"shard{i}"))
+            os.makedirs(dirs[-1], exist_ok=True)
+        self.index = ShardedIndex(dirs)
+
+
+class InvertedShardedIndexTest(index_test.IndexTest):
+    def create_index(self):
+        dirs = []
+        for i in range(2):
+            dirs.append(os.path.join(self.tempfolder_path, f"shard{i}"))
+            os.makedirs(dirs[-1], exist_ok=True)
+        self.index = ShardedIndex(dirs, True)
+
+
+class RebalanceTest(unittest.TestCase):
+    def setUp(self):
+        self.tempfolder = tempfile.TemporaryDirectory()
+        self.dirs = []
+        for i in range(3):
+            self.dirs.append(os.path.join(self.tempfolder.name, f"shard{i}"))
+            os.makedirs(self.dirs[-1])
+
+    def tearDown(self):
+        self.tempfolder.cleanup()
+
+    def check_placement(self, index, count):
+        self.assertEqual(len(index.search("common")), count)
+        for shard in index.shards:
+            for entry in shard.entries():
+                self.assertIs(index.shard_for(entry.entry_id), shard)
+                self.assertTrue(shard.fm.contains(entry.entry_id))
+
+    def test_add_shard_moves_entries(self):
+        index = ShardedIndex(self.dirs[:1])
+        entries = [index.add_entry(f"file{i}.txt", "common",
+                                   f"content {i}".encode())
+                   for i in range(60)]
+        self.assertGreater(index.add_shard(self.dirs[1]).result(), 0)
+        self.check_placement(index, 60)
+        self.assertTrue(all(shard.search("common")
+                            for shard in index.shards))
+        for i, entry in enumerate(entries):
+            self.assertEqual(index.get_file(entry.entry_id).read(),
+                             f"content {i}".encode())
+        index.close()
+
+    def test_configured_shard_is_filled_on_start(self):
+        index = ShardedIndex(self.dirs[:2])
+        for i in range(60):
+            index.add_entry(f"file{i}.txt", "common", f"{i}".encode())
+        index.close()
+        index = ShardedIndex(self.dirs)
+        self.assertGreater(index.rebalance_future.result(), 0)
+        self.check_placement(index, 60)
+        self.assertEqual(index.rebalance(), 0)
+        index.close()
+
+    def test_rebalance_doesnt_lock_while_rewriting(self):
+        index = ShardedIndex(self.dirs[:1])
+        for i in range(20):
+            index.add_entry(f"file{i}.txt", "common", f"{i}".encode())
+        shard = index.shards[0]
+        build_state = shard.engine.build_state
+        free = []
+
+        def try_lock():
+            if index.lock.acquire(blocking=False):
+                index.lock.release()
+                return True
+            return False
+
+        def checking_build_state(entries):
+            # other threads can add entries meanwhile
+            with ThreadPoolExecutor(1) as executor:
+                free.append(executor.submit(try_lock).result())
+            return build_state(entries)
+        shard.engine.build_state = checking_build_state
+        index.add_shard(self.dirs[1]).result()
+        self.assertEqual(free, [True])
+        self.check_placement(index, 20)
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()